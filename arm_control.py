@@ -1,5 +1,6 @@
 import time
-import pyudev
+from collections import deque
+import glob
 import json
 # --- Add these lines at the VERY TOP ---
 import os
@@ -12,10 +13,17 @@ if sdk_path not in sys.path:
 
 from STservo_sdk import *  # Ensure this is the correct import
 
+# orjson serializes in C and is much faster than json when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Constants
 CALIBRATION_SPEED = 300
 CALIBRATION_ACCELERATION = 50
 CALIBRATION_BACKOFF = 50
+CALIBRATION_MOVE_TIMEOUT = 2.0  # Longest wait for a motor to reach a calibration position
 MOVEMENT_UPDATE_INTERVAL = 0.05
 INITIAL_MIN_POS = 1024
 INITIAL_MAX_POS = 3072
@@ -23,17 +31,27 @@ THUMB_INITIAL_MIN = 2048
 THUMB_INITIAL_MAX = 2500
 CALIBRATION_FILE = "calibration.json"
 CALIBRATED_MOTORS = [1, 2, 3, 4, 5, 6]  # Include ALL motors now
+# Limit each move direction drives a motor toward
+DIRECTION_LIMITS = {
+    "inc": "max", "down": "max", "right": "max",
+    "dec": "min", "up": "min", "left": "min",
+}
+POSITION_TOLERANCE = 20  # Steps from the goal that count as arrived
+POSITION_POLL_INTERVAL = 0.005  # Seconds between position reads while waiting on a motor
+STALL_WINDOW = 0.1  # A motor whose readings stayed within STALL_THRESHOLD for this many seconds has stalled
+STALL_THRESHOLD = 2  # Largest spread of positions (in steps) across the window that counts as stalled
+FIND_LIMIT_TIMEOUT = 15.0  # Give up looking for a limit after this many seconds
+POSITION_CACHE_MAX_AGE = 0.02  # Seconds a bulk position reading serves read_pos()
+TEMPERATURE_MAX_AGE = 1.0  # Seconds a temperature reading is reused before reading it again
 
 
 def scan_interfaces_for_arm():
     """Scan for SO-ARM100 robot arm connected via USB."""
-    interfaces = []
-    context = pyudev.Context()
-    for device in context.list_devices(subsystem='tty'):
-        device_node = device.device_node
-        if device_node and "ttyACM" in device_node:
-            print(f"Found SO-ARM100 interface: {device_node}")
-            interfaces.append(device_node)
+    # Only ttyACM devices can be the arm, so list those directly instead of
+    # enumerating the whole tty subsystem through udev
+    interfaces = sorted(glob.glob("/dev/ttyACM*"))
+    for device_node in interfaces:
+        print(f"Found SO-ARM100 interface: {device_node}")
 
     if not interfaces:
         print("No SO-ARM100 controllers found")
@@ -51,6 +69,9 @@ class MotorController:
     def __init__(self, packet_handler):
         self.packet_handler = packet_handler
         self.last_positions = {}
+        self.last_temperatures = {}  # motor_id -> (temperature, time read)
+        self.position_cache = {}  # motor_id -> position from the last refresh_positions()
+        self.position_cache_time = 0.0
         # self.wrist_direction = 1  # No longer needed
         # self.thumb_direction = 1  # No longer needed
         self.motor_limits = {}  # Store calibrated min/max positions
@@ -64,6 +85,13 @@ class MotorController:
             5: {"name": "hand", "min_pos": 0, "max_pos": 4095},  # Now we calibrate.
             6: {"name": "thumb", "min_pos": THUMB_INITIAL_MIN, "max_pos": THUMB_INITIAL_MAX}
         }
+        # Motor name -> ID lookup; calibrated names are added as they become known
+        self.name_to_id = {data["name"]: motor_id for motor_id, data in self.initial_motor_data.items()}
+        # Motor ID -> midpoint, recomputed whenever motor_limits changes
+        self.midpoints = {}
+        self.recompute_midpoints()
+        # Reads the present position of several motors in one bus transaction
+        self.group_sync_read = GroupSyncRead(packet_handler, STS_PRESENT_POSITION_L, 2)
 
     def calibrate_motor(self, motor_id, motor_name, initial_min, initial_max):
         """Calibrate a single motor, moving other motors to midpoint."""
@@ -76,22 +104,18 @@ class MotorController:
             else:
                 motor3_pos = self.initial_motor_data[3]["max_pos"]
             self.write_pos_ex(3, motor3_pos, CALIBRATION_SPEED, CALIBRATION_ACCELERATION)
-            time.sleep(2)  # Wait for motor 3
+            self.wait_for_positions({3: motor3_pos}, CALIBRATION_MOVE_TIMEOUT)  # Wait for motor 3
 
-        # Move other motors to their midpoints
-        for other_motor_id in CALIBRATED_MOTORS:
-            if other_motor_id != motor_id:
-                if other_motor_id in self.motor_limits:
-                    midpoint = (self.motor_limits[other_motor_id]["min"] + self.motor_limits[other_motor_id]["max"]) // 2
-                else:
-                     midpoint = (self.initial_motor_data[other_motor_id]["min_pos"] + self.initial_motor_data[other_motor_id]["max_pos"]) // 2
-                self.write_pos_ex(other_motor_id, midpoint, CALIBRATION_SPEED, CALIBRATION_ACCELERATION)
-        time.sleep(2)
+        # Move other motors to their midpoints, all in one sync write
+        midpoints = {other_motor_id: self.midpoints[other_motor_id]
+                     for other_motor_id in CALIBRATED_MOTORS if other_motor_id != motor_id}
+        self.sync_write_pos_ex(midpoints, CALIBRATION_SPEED, CALIBRATION_ACCELERATION)
+        self.wait_for_positions(midpoints, CALIBRATION_MOVE_TIMEOUT)
 
 
         # Move to initial minimum position.
         self.write_pos_ex(motor_id, initial_min, CALIBRATION_SPEED, CALIBRATION_ACCELERATION)
-        time.sleep(2)
+        self.wait_for_positions({motor_id: initial_min}, CALIBRATION_MOVE_TIMEOUT)
 
         # Move towards minimum
         self.move_to_limit(motor_id, -1)
@@ -105,7 +129,7 @@ class MotorController:
 
         # Move to initial maximum position.
         self.write_pos_ex(motor_id, initial_max, CALIBRATION_SPEED, CALIBRATION_ACCELERATION)
-        time.sleep(2)
+        self.wait_for_positions({motor_id: initial_max}, CALIBRATION_MOVE_TIMEOUT)
 
         # Move towards maximum
         self.move_to_limit(motor_id, 1) # Pass direction
@@ -118,6 +142,8 @@ class MotorController:
         print(f"  Calibrated maximum for {motor_name}: {max_pos}")
 
         self.motor_limits[motor_id] = {"min": min_pos, "max": max_pos, "name": motor_name}
+        self.name_to_id[motor_name] = motor_id
+        self.recompute_midpoints()
         return min_pos, max_pos
 
     def move_to_limit(self, motor_id, direction):
@@ -127,46 +153,48 @@ class MotorController:
 
     def find_limit(self, motor_id, direction):  # Add direction argument
         """Move motor until it stalls."""
-        last_pos_result = self.packet_handler.ReadPos(motor_id)
-        time.sleep(0.1)
-        current_pos_result = self.packet_handler.ReadPos(motor_id)
-
-        if last_pos_result is None or current_pos_result is None:
-            print(f"Warning: ReadPos returned None for motor {motor_id}.")
-            return None
-
-        last_pos = last_pos_result[0]
-        current_pos = current_pos_result[0]
-
-        while abs(current_pos - last_pos) > 2:
-            last_pos = current_pos
-            time.sleep(0.1)
+        # Poll quickly, but judge a stall over the last STALL_WINDOW seconds
+        # so a slow-moving motor isn't mistaken for a stalled one. Every
+        # reading in the window must agree, so one jittery pair can't end
+        # the search early.
+        samples = deque()
+        deadline = time.monotonic() + FIND_LIMIT_TIMEOUT
+        while True:
             current_pos_result = self.packet_handler.ReadPos(motor_id)
             if current_pos_result is None:
                 print(f"Warning: ReadPos returned None for motor {motor_id} during stall detection.")
                 return None
+            now = time.monotonic()  # Immune to wall-clock jumps, e.g. NTP sync at boot
+            if now > deadline:
+                print(f"Warning: motor {motor_id} did not stall within {FIND_LIMIT_TIMEOUT}s.")
+                return None
             current_pos = current_pos_result[0]
-        return current_pos
+            samples.append((now, current_pos))
+
+            # Drop samples older than the window, keeping one at its edge
+            while len(samples) > 1 and now - samples[1][0] >= STALL_WINDOW:
+                samples.popleft()
+            if now - samples[0][0] >= STALL_WINDOW:
+                positions = [pos for _, pos in samples]
+                if max(positions) - min(positions) <= STALL_THRESHOLD:
+                    return current_pos
+
+            time.sleep(POSITION_POLL_INTERVAL)
 
 
 
     def move_motor(self, motor_id, motor_name, direction, speed=500):
-        """Moves a motor toward its limit in the specified direction and returns the actual final position."""
+        """Starts a motor toward its limit in the specified direction and returns without waiting for it."""
 
         if motor_id not in self.motor_limits:
             print(f"  ERROR: Motor {motor_id} ({motor_name}) not calibrated!")
             return {"success": False, "message": f"Motor {motor_id} ({motor_name}) not calibrated!"}
 
-        min_pos = self.motor_limits[motor_id]["min"]
-        max_pos = self.motor_limits[motor_id]["max"]
-
         # Convert direction to target position
-        if direction in ("inc", "down", "right"):
-            target_position = max_pos
-        elif direction in ("dec", "up", "left"):
-            target_position = min_pos
-        else:
+        limit = DIRECTION_LIMITS.get(direction)
+        if limit is None:
             return {"success": False, "message": f"Invalid direction: {direction}"}
+        target_position = self.motor_limits[motor_id][limit]
 
         print(f"Moving {motor_name} ({motor_id}) to {target_position} at speed {speed}")
 
@@ -179,24 +207,21 @@ class MotorController:
             print(f"  ERROR: Failed to move {motor_name} (Motor {motor_id}) in direction {direction}")
             return {"success": False, "message": f"Failed to move {motor_name} in direction {direction}"}
 
-        # Read the actual new position from the motor
-        new_pos_result = self.packet_handler.ReadPos(motor_id)
-        if new_pos_result is None:
-            print(f"Warning: Failed to read final position for motor {motor_id} ({motor_name}).")
+        # The motor has barely started moving, so report the last bulk reading
+        # instead of spending a bus round trip on a fresh one
+        new_position = self.position_cache.get(motor_id)
+        if new_position is None:
             new_position = -1  # Placeholder for "unknown position"
-        else:
-            new_position = new_pos_result[0]  # Extract position from the result tuple
 
-        # Get temperature (replace with actual SDK call if available)
-        temp_result, _, _ = self.packet_handler.ReadTemperature(motor_id)
-        temperature = temp_result if temp_result is not None else -1  # Use -1 as a placeholder for "unknown"
+        temperature = self.read_temperature(motor_id)
 
         # Calculate and format duration
         duration_ms = round((end_time - start_time) * 1000, 1)  # Convert to milliseconds and round
 
         return {
             "success": True,
-            "end_position": new_position,  # Return actual position
+            "target_position": target_position,
+            "end_position": new_position,  # Last bulk reading, or -1 if unknown
             "duration": duration_ms,  # Return milliseconds
             "temp": temperature,
             "message": f"Moved {motor_name} to {new_position}"
@@ -220,12 +245,11 @@ class MotorController:
         position = max(min_pos, min(max_pos, int(position)))
 
         # Read the current motor position before moving
-        current_pos_result = self.packet_handler.ReadPos(motor_id)
-        if current_pos_result is None:
+        start_pos = self.read_pos(motor_id)
+        if start_pos is None:
             print(f"  ERROR: ReadPos failed for motor {motor_id}.")
             return {"success": False, "message": f"ReadPos failed for motor {motor_id}."}
 
-        start_pos = current_pos_result[0]
         print(f"  start_pos: {start_pos}")
 
         # Send movement command
@@ -238,13 +262,12 @@ class MotorController:
 
         # Wait until the motor reaches the target position
         while True:
-            time.sleep(0.1)  # Small delay to avoid excessive CPU usage
+            time.sleep(POSITION_POLL_INTERVAL)  # Roughly a few bus round trips
             current_pos_result = self.packet_handler.ReadPos(motor_id)
             if current_pos_result is None:
                 print(f"  ERROR: ReadPos failed for motor {motor_id} during movement.")
                 break  # Exit loop if position reading fails
             new_position = current_pos_result[0]
-            print(f"  Current position: {new_position}, Target: {position}")
 
             # Allow some tolerance for minor fluctuations in reported position
             if abs(new_position - position) < 5:
@@ -252,9 +275,7 @@ class MotorController:
 
         end_time = time.time()
 
-        # Get temperature (replace with actual SDK call if available)
-        temp_result, _, _ = self.packet_handler.ReadTemperature(motor_id)
-        temperature = temp_result if temp_result is not None else -1  # Use -1 as a placeholder for "unknown"
+        temperature = self.read_temperature(motor_id)
 
         # Calculate movement duration in milliseconds
         duration_ms = round((end_time - start_time) * 1000, 1)
@@ -269,6 +290,19 @@ class MotorController:
         }
 
 
+    def read_temperature(self, motor_id):
+        """Returns the motor temperature, reading it at most once per TEMPERATURE_MAX_AGE."""
+        cached = self.last_temperatures.get(motor_id)
+        now = time.time()
+        if cached is not None and now - cached[1] < TEMPERATURE_MAX_AGE:
+            return cached[0]
+
+        temp_result, _, _ = self.packet_handler.ReadTemperature(motor_id)
+        if temp_result is None:
+            return -1  # Use -1 as a placeholder for "unknown"
+        self.last_temperatures[motor_id] = (temp_result, now)
+        return temp_result
+
     def stop_motor(self, motor_id, motor_name):
         """Stops a specific motor by setting its goal position to its current position."""
         current_pos_result = self.packet_handler.ReadPos(motor_id)
@@ -279,15 +313,144 @@ class MotorController:
         current_position = current_pos_result[0]
         print(f"Stopping motor {motor_name} at position {current_position}")
 
-        self.write_pos_ex(motor_id, current_position, speed=0, acc=0)
+        if not self.write_pos_ex(motor_id, current_position, speed=0, acc=0):
+            return {"success": False, "message": f"Failed to stop {motor_name}"}
         return {"success": True, "message": f"Stopped {motor_name}"}
 
 
+    def stop_all(self, motor_ids):
+        """Stops several motors at once by holding each at its current position.
+
+        Positions come from one sync read and the goals go out in one sync write,
+        so every motor halts within a couple of bus transactions. Motors missing
+        from the sync read, or every motor if the sync write fails, are stopped
+        one at a time. Returns a status dict and the positions the motors were
+        stopped at.
+        """
+        positions = self.read_positions(motor_ids)
+        result = {"success": True, "message": "All motors stopped"}
+        fallback = {motor_id for motor_id in motor_ids if motor_id not in positions}
+        if positions and not self.sync_write_pos_ex(positions, 0, 0):
+            result = {"success": False, "message": "Sync stop failed; stopped motors one at a time"}
+            fallback = set(motor_ids)
+
+        for motor_id in motor_ids:
+            if motor_id in fallback:
+                motor_result = self.stop_motor(motor_id, self.initial_motor_data[motor_id]["name"])
+                if not motor_result["success"] and result["success"]:
+                    result = motor_result  # Report the first error
+        return result, positions
+
     def write_pos_ex(self, motor_id, position, speed, acc):
-        """Wrapper for WritePosEx."""
+        """Wrapper for WritePosEx. Returns True if the motor accepted the goal."""
         result, error = self.packet_handler.WritePosEx(motor_id, position, speed, acc)
         if result != COMM_SUCCESS or error != 0:
             print(f"Failed to move Motor {motor_id} to position {position}")
+            return False
+        return True
+
+    def recompute_midpoints(self):
+        """Recomputes the midpoint of every motor after motor_limits changes."""
+        self.midpoints = {motor_id: (data["min_pos"] + data["max_pos"]) // 2
+                          for motor_id, data in self.initial_motor_data.items()}
+        self.midpoints.update({motor_id: (limits["min"] + limits["max"]) // 2
+                               for motor_id, limits in self.motor_limits.items()})
+
+    def midpoint(self, motor_id):
+        """Returns the middle of a motor's calibrated range, or of its initial range if uncalibrated."""
+        return self.midpoints[motor_id]
+
+    def sync_write_pos_ex(self, targets, speed, acc):
+        """Sends goal positions for several motors in one sync-write packet.
+
+        targets maps motor ID to goal position. Returns False if any motor
+        couldn't be queued or the packet failed to send.
+        """
+        queued = True
+        for motor_id, position in targets.items():
+            if not self.packet_handler.SyncWritePosEx(motor_id, position, speed, acc):
+                print(f"Failed to queue Motor {motor_id} for sync write")
+                queued = False
+        return self.flush_moves() and queued
+
+    def queue_move(self, motor_id, motor_name, direction, speed=500):
+        """Queues a move toward a limit; nothing is sent until flush_moves()."""
+        if motor_id not in self.motor_limits:
+            print(f"  ERROR: Motor {motor_id} ({motor_name}) not calibrated!")
+            return {"success": False, "message": f"Motor {motor_id} ({motor_name}) not calibrated!"}
+
+        limit = DIRECTION_LIMITS.get(direction)
+        if limit is None:
+            return {"success": False, "message": f"Invalid direction: {direction}"}
+        target_position = self.motor_limits[motor_id][limit]
+
+        if not self.packet_handler.SyncWritePosEx(motor_id, target_position, speed, 50):
+            return {"success": False, "message": f"Failed to queue move for {motor_name}"}
+        return {"success": True, "target_position": target_position,
+                "message": f"Moving {motor_name} to {target_position}"}
+
+    def flush_moves(self):
+        """Sends every queued goal position in one sync-write packet."""
+        result = self.packet_handler.groupSyncWrite.txPacket()
+        self.packet_handler.groupSyncWrite.clearParam()
+        if result != COMM_SUCCESS:
+            print(f"Sync write failed: {self.packet_handler.getTxRxResult(result)}")
+            return False
+        return True
+
+    def read_positions(self, motor_ids):
+        """Reads the present position of several motors with one sync read.
+
+        Returns a dict of motor ID to position, leaving out motors that didn't answer.
+        """
+        for motor_id in motor_ids:
+            self.group_sync_read.addParam(motor_id)
+        result = self.group_sync_read.txRxPacket()
+        positions = {}
+        if result == COMM_SUCCESS:
+            for motor_id in motor_ids:
+                available, _ = self.group_sync_read.isAvailable(motor_id, STS_PRESENT_POSITION_L, 2)
+                if available:
+                    position = self.group_sync_read.getData(motor_id, STS_PRESENT_POSITION_L, 2)
+                    positions[motor_id] = self.packet_handler.sts_tohost(position, 15)
+        self.group_sync_read.clearParam()
+        return positions
+
+    def refresh_positions(self):
+        """Reads every calibrated motor's position in one sync read and caches the result."""
+        self.position_cache = self.read_positions(CALIBRATED_MOTORS)
+        self.position_cache_time = time.monotonic()
+        return self.position_cache
+
+    def read_pos(self, motor_id, max_age=POSITION_CACHE_MAX_AGE):
+        """Returns a motor's position, or None if it can't be read.
+
+        Readings come from a bulk sync read of all motors, which is repeated
+        only when the cached one is older than max_age seconds.
+        """
+        if time.monotonic() - self.position_cache_time > max_age:
+            self.refresh_positions()
+        return self.position_cache.get(motor_id)
+
+    def wait_for_positions(self, targets, timeout, tolerance=POSITION_TOLERANCE):
+        """Polls until every motor in targets is within tolerance of its goal.
+
+        Returns True if all motors arrived, False if the timeout ran out first.
+        """
+        pending = dict(targets)
+        deadline = time.monotonic() + timeout
+        while pending:
+            positions = self.read_positions(list(pending))
+            for motor_id, position in positions.items():
+                if abs(position - pending[motor_id]) <= tolerance:
+                    del pending[motor_id]
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                print(f"Motors {sorted(pending)} did not reach their targets in {timeout}s")
+                return False
+            time.sleep(self.update_interval)
+        return True
 
     def load_calibration(self):
         """Loads calibration data."""
@@ -295,6 +458,8 @@ class MotorController:
             with open(CALIBRATION_FILE, "r") as f:
                 loaded_data = json.load(f)
                 self.motor_limits = {int(k): v for k, v in loaded_data.items()}
+                self.name_to_id.update({v["name"]: k for k, v in self.motor_limits.items() if "name" in v})
+                self.recompute_midpoints()
             print("Calibration data loaded.")
             return True
         except FileNotFoundError:
@@ -306,7 +471,12 @@ class MotorController:
 
     def save_calibration(self):
         """Saves calibration data."""
-        with open(CALIBRATION_FILE, "w") as f:
-            json.dump(self.motor_limits, f, indent=4)
+        if orjson is not None:
+            # Motor IDs are int keys, which orjson only accepts with OPT_NON_STR_KEYS
+            with open(CALIBRATION_FILE, "wb") as f:
+                f.write(orjson.dumps(self.motor_limits, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(CALIBRATION_FILE, "w") as f:
+                json.dump(self.motor_limits, f, indent=4)
         print("Calibration data saved.")
 
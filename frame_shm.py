@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+import struct
+
+# Layout of the shared memory segment python_stream_server publishes frames
+# to. It is a double buffer: the header holds a frame sequence number and the
+# length of the frame in each of two slots, and the rest of the segment is
+# split into those slots. Frame n lives in slot n % 2, so the writer always
+# fills the slot readers aren't pointed at. Fields are native and aligned so
+# each one can be read and stored in one piece.
+FRAME_SHM_HEADER = struct.Struct('QII')
+FRAME_SHM_SEQ = struct.Struct('Q')
+FRAME_SHM_LENGTH = struct.Struct('I')
+
+
+def store_field(buf, offset, field, value):
+    """
+    Store one header field with a single write. struct.pack_into zeroes the
+    field before packing it, so a reader could see a sequence number of 0.
+    """
+    memoryview(buf)[offset:offset + field.size].cast(field.format)[0] = value
+
+
+def slot_offset(buf_size, slot):
+    """Return the offset and size of a frame slot in a segment of buf_size bytes"""
+    slot_size = (buf_size - FRAME_SHM_HEADER.size) // 2
+    return FRAME_SHM_HEADER.size + slot * slot_size, slot_size
+
+
+def write_frame(buf, frame_bytes):
+    """
+    Copy an encoded frame into the inactive slot, then publish it by bumping
+    the sequence number. There must be a single writer, which needs no lock.
+    Returns False if the frame doesn't fit in a slot.
+    """
+    size = len(frame_bytes)
+    seq = FRAME_SHM_SEQ.unpack_from(buf)[0] + 1
+    slot = seq % 2
+    start, slot_size = slot_offset(len(buf), slot)
+    if size > slot_size:
+        return False
+
+    buf[start:start + size] = frame_bytes
+    store_field(buf, FRAME_SHM_SEQ.size + slot * FRAME_SHM_LENGTH.size, FRAME_SHM_LENGTH, size)
+    store_field(buf, 0, FRAME_SHM_SEQ, seq)
+    return True
+
+
+def read_frame(buf, last_seq):
+    """
+    Copy the newest frame out of the segment. Returns (seq, frame), or None if
+    there is no frame newer than last_seq or the copy may be torn.
+    """
+    seq, *sizes = FRAME_SHM_HEADER.unpack_from(buf)
+    slot = seq % 2
+    if seq == last_seq or sizes[slot] == 0:
+        return None
+
+    start, _ = slot_offset(len(buf), slot)
+    frame = bytes(buf[start:start + sizes[slot]])
+    # Once the sequence moves on, the writer may already be refilling this
+    # slot with the frame after next, so any change means the copy is suspect
+    if FRAME_SHM_SEQ.unpack_from(buf)[0] != seq:
+        return None
+    return seq, frame
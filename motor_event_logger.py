@@ -1,36 +1,108 @@
 #!/usr/bin/python3
 
 import os
+import re
 import json
+import queue
 import time
 from datetime import datetime
 import threading
 import shutil
 from video_capture import VideoCapture
 
+# orjson serializes in C and is much faster than json when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Matches episode directory names and captures the episode number
+EPISODE_DIR_PATTERN = re.compile(r'^episode_(\d+)$')
+
+# Seconds between disk space checks while logging events
+DISK_CHECK_INTERVAL = 2.0
+
+# Camera frames waiting to be written; when full, new frames are dropped
+FRAME_WRITE_QUEUE_SIZE = 64
+
+def write_json(path, data):
+    """Writes data to path as indented JSON"""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+def json_line(data):
+    """Returns data as one newline-terminated line of JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data) + "\n").encode("utf-8")
+
 class MotorEventLogger:
     """
     Logger that captures motor events in the LeRobot-compatible format for GR00T.
     Designed to log when motors start, stop, or change direction.
     """
     
-    def __init__(self, base_dir="data", disk_threshold_gb=1, video_sources=None):
+    def __init__(self, base_dir="data", disk_threshold_gb=1, video_sources=None, event_format="files"):
+        """
+        Args:
+            event_format (str): 'files' writes a robot_state and an action JSON
+                file per event; 'jsonl' appends both to one events.jsonl per
+                episode, which avoids creating two files for every event
+        """
         self.base_dir = base_dir
+        self.event_format = event_format
+        self.events_file = None
+        self.events_lock = threading.Lock()  # Held while events_file is written or closed
         self.current_episode = None
+        self.episode_prefix = None  # Episode directory plus separator, for event file names
         self.is_logging = False
         self.timestamp_counter = 0
         self.disk_threshold_bytes = disk_threshold_gb * 1024 * 1024 * 1024
         self.metadata = {}
         self.timeout_timer = None
         self.video_captures = []
+        self.last_disk_check = 0.0  # time.monotonic() of the last disk space check
+        self.last_free_bytes = 0
+        self.dropped_frames = 0
+        
+        # Camera frames are written to disk by a separate thread so that
+        # logging an event never waits on the disk
+        self.frame_write_queue = queue.Queue(maxsize=FRAME_WRITE_QUEUE_SIZE)
+        self.frame_writer = threading.Thread(target=self._frame_writer_loop, daemon=True)
+        self.frame_writer.start()
         
         # Ensure base directory exists
         os.makedirs(base_dir, exist_ok=True)
         
+        # Scan for existing episodes once; after that the number is counted in memory
+        self.next_episode = self._scan_next_episode()
+        
         # Setup video capture if sources are provided
         if video_sources:
             self.setup_video_sources(video_sources)
     
+    def _frame_writer_loop(self):
+        """Writes queued camera frames to disk"""
+        while True:
+            save_path, frame = self.frame_write_queue.get()
+            try:
+                VideoCapture.write_frame(save_path, frame)
+            finally:
+                self.frame_write_queue.task_done()
+    
+    def _scan_next_episode(self):
+        """Returns one past the highest episode number in base_dir"""
+        episode_numbers = []
+        for entry in os.listdir(self.base_dir):
+            match = EPISODE_DIR_PATTERN.match(entry)
+            if match and os.path.isdir(os.path.join(self.base_dir, entry)):
+                episode_numbers.append(int(match.group(1)))
+        return max(episode_numbers, default=-1) + 1
+    
     def setup_video_sources(self, video_sources):
         """
         Set up video capture sources
@@ -39,7 +111,7 @@ class MotorEventLogger:
             video_sources (list): List of dictionaries with video source configurations
                 Each dictionary should contain:
                 - 'source': URL or device ID
-                - 'method': 'stream' or 'opencv'
+                - 'method': 'stream', 'opencv' or 'shm'
                 - 'camera_id': ID for the camera (used in filenames)
         """
         # Stop any existing captures
@@ -92,14 +164,11 @@ class MotorEventLogger:
         # Create a new episode directory
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        # Get the next episode number
-        episode_dirs = [d for d in os.listdir(self.base_dir) 
-                      if os.path.isdir(os.path.join(self.base_dir, d)) and d.startswith("episode_")]
-        episode_count = len(episode_dirs)
-        
-        self.current_episode = f"episode_{episode_count:04d}"
+        self.current_episode = f"episode_{self.next_episode:04d}"
+        self.next_episode += 1
         episode_dir = os.path.join(self.base_dir, self.current_episode)
         os.makedirs(episode_dir, exist_ok=True)
+        self.episode_prefix = os.path.join(episode_dir, "")
         
         # Save metadata
         self.metadata = {
@@ -108,14 +177,19 @@ class MotorEventLogger:
             "start_time": timestamp,
             "timeout": timeout,
             "cameras": [{"camera_id": cap.camera_id} for cap in self.video_captures],
+            "event_format": self.event_format,
             **kwargs
         }
         
-        with open(os.path.join(episode_dir, "metadata.json"), "w") as f:
-            json.dump(self.metadata, f, indent=2)
+        write_json(os.path.join(episode_dir, "metadata.json"), self.metadata)
+        
+        # One buffered, append-only file for the whole episode
+        if self.event_format == "jsonl":
+            self.events_file = open(os.path.join(episode_dir, "events.jsonl"), "ab", buffering=1 << 20)
         
         # Reset timestamp counter
         self.timestamp_counter = 0
+        self.dropped_frames = 0
         self.is_logging = True
         
         # Start video captures if available
@@ -155,14 +229,23 @@ class MotorEventLogger:
         
         self.is_logging = False
         
+        # Let the episode's frames reach the disk before it is closed
+        self.frame_write_queue.join()
+        
+        # Flush and close the episode's event log
+        with self.events_lock:
+            if self.events_file is not None:
+                self.events_file.close()
+                self.events_file = None
+        
         # Update metadata with end time
         if self.current_episode:
             episode_dir = os.path.join(self.base_dir, self.current_episode)
             self.metadata["end_time"] = datetime.now().strftime("%Y%m%d_%H%M%S")
             self.metadata["total_events"] = self.timestamp_counter
+            self.metadata["dropped_frames"] = self.dropped_frames
             
-            with open(os.path.join(episode_dir, "metadata.json"), "w") as f:
-                json.dump(self.metadata, f, indent=2)
+            write_json(os.path.join(episode_dir, "metadata.json"), self.metadata)
         
         return True, f"Logging stopped. Recorded {self.timestamp_counter} events."
     
@@ -185,13 +268,13 @@ class MotorEventLogger:
         if not self.is_logging or not self.current_episode:
             return False
         
-        # Check disk space
-        if self._check_disk_space() < self.disk_threshold_bytes:
+        # Check disk space (sampled, since events can arrive many times a second)
+        if self._check_disk_space(max_age=DISK_CHECK_INTERVAL) < self.disk_threshold_bytes:
             self.stop_logging()
             return False
         
-        episode_dir = os.path.join(self.base_dir, self.current_episode)
-        timestamp_str = f"{self.timestamp_counter:08d}"
+        # Every event file in the episode starts with the same directory and index
+        event_prefix = f"{self.episode_prefix}{self.timestamp_counter:08d}"
         
         # Create robot state and action data
         timestamp = time.time()
@@ -224,27 +307,47 @@ class MotorEventLogger:
         if target_pos is not None:
             action_data["target_position"] = target_pos
         
-        # Save robot state
-        robot_state_file = os.path.join(episode_dir, f"{timestamp_str}_robot_state.json")
-        with open(robot_state_file, "w") as f:
-            json.dump(robot_state, f, indent=2)
-        
-        # Save action
-        action_file = os.path.join(episode_dir, f"{timestamp_str}_action.json")
-        with open(action_file, "w") as f:
-            json.dump(action_data, f, indent=2)
+        if self.event_format == "jsonl":
+            # stop_logging closes the file from other threads (the executor or
+            # the timeout timer), so check it is still open under the lock
+            with self.events_lock:
+                if self.events_file is None:
+                    return False
+                # Append both records as one line
+                self.events_file.write(json_line({
+                    "index": self.timestamp_counter,
+                    "robot_state": robot_state,
+                    "action": action_data
+                }))
+        else:
+            # Save robot state
+            write_json(event_prefix + "_robot_state.json", robot_state)
+            
+            # Save action
+            write_json(event_prefix + "_action.json", action_data)
         
-        # Capture and save frames from all cameras
+        # Capture frames from all cameras now and queue them to be saved
         for capture in self.video_captures:
             if capture:
-                camera_file = os.path.join(episode_dir, f"{timestamp_str}_camera-{capture.camera_id}.jpg")
-                capture.save_frame(camera_file)
+                frame = capture.peek_frame()
+                if frame is None:
+                    continue
+                camera_file = f"{event_prefix}_camera-{capture.camera_id}.jpg"
+                try:
+                    self.frame_write_queue.put_nowait((camera_file, frame))
+                except queue.Full:
+                    # The disk can't keep up; a late frame is worth less than a prompt event
+                    self.dropped_frames += 1
         
         # Increment timestamp counter
         self.timestamp_counter += 1
         
         return True
     
-    def _check_disk_space(self):
-        """Check available disk space in bytes"""
-        return shutil.disk_usage(self.base_dir).free
+    def _check_disk_space(self, max_age=0):
+        """Check available disk space in bytes, reusing a reading up to max_age seconds old"""
+        now = time.monotonic()
+        if now - self.last_disk_check >= max_age:
+            self.last_free_bytes = shutil.disk_usage(self.base_dir).free
+            self.last_disk_check = now
+        return self.last_free_bytes
@@ -1,21 +1,117 @@
 #!/usr/bin/env python3
 """
-Video streaming server using Flask and OpenCV
+Video streaming server using aiohttp (or Flask when aiohttp is missing) and OpenCV
 """
 from flask import Flask, Response, render_template
 import cv2
 import argparse
+import asyncio
 import threading
 import time
 import os
+import shutil
+import subprocess
+from multiprocessing import resource_tracker, shared_memory
+from frame_shm import FRAME_SHM_HEADER, write_frame
+
+# aiohttp is optional; when present each viewer is a coroutine instead of a thread
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+# GStreamer is optional; when present it lets us use the hardware JPEG encoder
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+# simplejpeg is optional; it encodes with libjpeg-turbo without OpenCV's overhead
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# linuxpy is optional; it reads MJPEG straight from the V4L2 mmap buffers
+try:
+    from linuxpy.video.device import Device as V4L2Device, VideoCapture as V4L2Capture
+except ImportError:
+    V4L2Device = None
+
+# picamera2 is optional; it drives Pi camera modules (CSI) through libcamera
+# and can encode on the Pi's hardware MJPEG encoder
+try:
+    from picamera2 import Picamera2
+    from picamera2.encoders import MJPEGEncoder
+    from picamera2.outputs import Output
+except ImportError:
+    Picamera2 = None
 
 # Create Flask application
 app = Flask(__name__)
 
 # Global variables
 camera = None
-output_frame = None
+output_jpeg = None  # Latest frame, encoded once and shared by every client
+output_part = None  # output_jpeg wrapped as a multipart part, ready to send
+frame_seq = 0  # Incremented each time a new frame is published
 lock = threading.Lock()
+frame_ready = threading.Condition(lock)
+frame_shm = None  # Shared memory segment other processes read frames from
+async_loop = None  # Event loop of the aiohttp server, when it is used
+frame_event = None  # asyncio.Event set once per frame, then replaced
+
+# Shared memory that also carries each frame to local readers (the episode
+# logger), so they don't have to parse the HTTP stream. See frame_shm for the
+# layout.
+FRAME_SHM_NAME = "robot_camera_jpeg"
+FRAME_SHM_SIZE = 1 << 20
+FRAME_SHM_MODE = 0o644  # Only the stream server writes; any user may read
+
+# GStreamer pipelines that deliver finished JPEG frames, tried in order.
+# The first uses the Raspberry Pi's hardware encoder (V4L2 M2M), the second
+# falls back to software jpegenc with the fast integer IDCT.
+GST_JPEG_PIPELINES = [
+    "v4l2src device=/dev/video0 io-mode=dmabuf ! "
+    "video/x-raw,width=640,height=480,framerate=30/1 ! v4l2convert ! "
+    "video/x-raw,format=NV12 ! v4l2jpegenc extra-controls=c,compression_quality=80 ! "
+    "appsink name=sink max-buffers=2 drop=true sync=false",
+    "v4l2src device=/dev/video0 ! "
+    "video/x-raw,width=640,height=480,framerate=30/1 ! videoconvert ! "
+    "jpegenc quality=80 idct-method=ifast ! "
+    "appsink name=sink max-buffers=2 drop=true sync=false",
+]
+GST_PULL_TIMEOUT = 1.0  # Seconds to wait for a frame before checking the pipeline for errors
+
+# Ask the camera for MJPEG so frames arrive already compressed
+MJPG_FOURCC = cv2.VideoWriter_fourcc(*'MJPG')
+
+# JPEG settings for the preview stream: baseline, no optimize pass, and
+# lower chroma than luma quality since the eye is less sensitive to color
+JPEG_ENCODE_PARAMS = [
+    cv2.IMWRITE_JPEG_QUALITY, 60,
+    cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+    cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+    cv2.IMWRITE_JPEG_RST_INTERVAL, 16,
+]
+if hasattr(cv2, 'IMWRITE_JPEG_CHROMA_QUALITY'):  # Needs a recent OpenCV
+    JPEG_ENCODE_PARAMS += [cv2.IMWRITE_JPEG_LUMA_QUALITY, 70,
+                           cv2.IMWRITE_JPEG_CHROMA_QUALITY, 35]
+
+# Fixed parts of each multipart MJPEG frame
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_PART_TRAILER = b'\r\n'
+
+# ffmpeg command used when GStreamer is not available. It writes a stream of
+# concatenated JPEG frames to stdout, so no encoding happens in Python.
+FFMPEG_COMMAND = [
+    "ffmpeg", "-loglevel", "error",
+    "-f", "v4l2", "-video_size", "640x480", "-framerate", "30", "-i", "/dev/video0",
+    "-c:v", "mjpeg", "-q:v", "5",
+    "-f", "mjpeg", "pipe:1",
+]
 
 # HTML template for the main page
 HTML_TEMPLATE = """
@@ -58,64 +154,352 @@ HTML_TEMPLATE = """
 </html>
 """
 
+def is_complete_jpeg(frame_bytes):
+    """
+    Check that camera data holds a whole JPEG. Drivers can hand back truncated
+    or empty MJPEG buffers, which browsers would show as a broken frame.
+    """
+    # Buffers may be padded after the end marker, so search back for it
+    return frame_bytes[:2] == b'\xff\xd8' and frame_bytes.rfind(b'\xff\xd9') > 2
+
+def open_frame_shm():
+    """
+    Create the shared memory segment frames are published to, or reuse one
+    left behind by a previous run. The segment outlives this process, so
+    readers keep working across restarts. Returns None if it can't be set up.
+    """
+    try:
+        try:
+            shm = shared_memory.SharedMemory(name=FRAME_SHM_NAME, create=True, size=FRAME_SHM_SIZE)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=FRAME_SHM_NAME)
+        # Otherwise the resource tracker unlinks the segment when we exit, and
+        # readers would be left mapping a segment nobody writes to anymore
+        resource_tracker.unregister(shm._name, "shared_memory")
+        # Segments are created owner-only; readers such as the robot control
+        # service run as another user and attach read-only
+        os.fchmod(shm._fd, FRAME_SHM_MODE)
+        FRAME_SHM_HEADER.pack_into(shm.buf, 0, 0, 0, 0)
+        return shm
+    except Exception as e:
+        print(f"Shared memory frame output unavailable: {e}")
+        return None
+
+def write_frame_shm(frame_bytes):
+    """
+    Publish an encoded frame to shared memory. Only the capture thread writes,
+    so no lock is needed and readers never see a slot while it is being filled.
+    """
+    if frame_shm is None:
+        return
+
+    write_frame(frame_shm.buf, frame_bytes)
+
+def publish_jpeg(frame_bytes):
+    """
+    Make an encoded frame the current output and wake the streaming clients.
+    frame_bytes may be any buffer, including one the caller reuses afterwards:
+    it is copied exactly once, into the multipart part.
+    """
+    global output_jpeg, output_part, frame_seq
+
+    # Build the multipart part once here, so clients just send the same bytes
+    part = b''.join((MJPEG_PART_HEADER, frame_bytes, MJPEG_PART_TRAILER))
+    # The JPEG inside the part, without copying it again
+    jpeg = memoryview(part)[len(MJPEG_PART_HEADER):len(part) - len(MJPEG_PART_TRAILER)]
+
+    with frame_ready:
+        output_jpeg = jpeg
+        output_part = part
+        frame_seq += 1
+        frame_ready.notify_all()
+
+    if async_loop is not None:
+        async_loop.call_soon_threadsafe(notify_async_clients)
+
+    write_frame_shm(jpeg)
+
+def notify_async_clients():
+    """
+    Wake the aiohttp clients waiting for a frame. Runs on the event loop.
+    """
+    global frame_event
+
+    # Clients wait on the current event; a fresh one catches the next frame
+    event, frame_event = frame_event, asyncio.Event()
+    event.set()
+
+def encode_frame(frame):
+    """
+    Encode a captured frame as JPEG. Returns the encoded bytes, or None on failure.
+    """
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(frame, quality=60, colorspace='BGR',
+                                      colorsubsampling='420', fastdct=True)
+
+    ret, encoded_frame = cv2.imencode('.jpg', frame, JPEG_ENCODE_PARAMS)
+    if not ret:
+        return None
+
+    # View the encoder's buffer directly instead of copying it with tobytes()
+    return memoryview(encoded_frame).cast('B')
+
+def capture_v4l2_frames():
+    """
+    Capture MJPEG frames directly from the V4L2 driver's mmap buffers and
+    update the global output_jpeg variable. Returns if the camera cannot
+    deliver MJPEG this way.
+    """
+    if V4L2Device is None:
+        return
+
+    try:
+        with V4L2Device.from_id(0) as device:
+            capture = V4L2Capture(device)
+            capture.set_format(640, 480, "MJPG")
+            print("Using V4L2 MJPEG capture")
+            with capture:
+                delivered = False
+                for frame in capture:
+                    frame_bytes = frame.data
+                    if not is_complete_jpeg(frame_bytes):
+                        if not delivered:
+                            print("V4L2 camera is not delivering MJPEG")
+                            return
+                        # Skip the damaged frame; clients keep the last good one
+                        continue
+                    delivered = True
+                    publish_jpeg(frame_bytes)
+    except Exception as e:
+        print(f"V4L2 capture unavailable: {e}")
+
+def capture_picamera2_frames():
+    """
+    Capture from a Pi camera module, encoding on the hardware MJPEG encoder,
+    and update the global output_jpeg variable. Returns if there is no such
+    camera.
+    """
+    if Picamera2 is None or not Picamera2.global_camera_info():
+        return
+
+    class PublishOutput(Output):
+        """picamera2 output that publishes each encoded frame"""
+        def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+            publish_jpeg(bytes(frame))
+
+    try:
+        picam2 = Picamera2()
+        picam2.configure(picam2.create_video_configuration(main={"size": (640, 480)}))
+        picam2.start_recording(MJPEGEncoder(), PublishOutput())
+    except Exception as e:
+        print(f"Pi camera capture unavailable: {e}")
+        return
+
+    print("Using Pi camera with hardware MJPEG encoder")
+    # Frames arrive on picamera2's threads; keep this thread alive
+    while True:
+        time.sleep(1)
+
+def open_jpeg_pipeline():
+    """
+    Start a GStreamer pipeline that produces JPEG frames, preferring the
+    hardware encoder. Returns the pipeline, or None if unavailable.
+    """
+    if Gst is None:
+        return None
+
+    Gst.init(None)
+    for description in GST_JPEG_PIPELINES:
+        try:
+            pipeline = Gst.parse_launch(description)
+        except Exception as e:
+            print(f"GStreamer pipeline unavailable: {e}")
+            continue
+
+        if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            print("GStreamer pipeline failed to start")
+            pipeline.set_state(Gst.State.NULL)
+            continue
+
+        print(f"Using GStreamer pipeline: {description}")
+        return pipeline
+
+    return None
+
+def capture_jpeg_frames(pipeline):
+    """
+    Pull encoded JPEG frames from a GStreamer pipeline's appsink and update the
+    global output_jpeg variable. Returns once the pipeline reports an error or
+    end of stream, so the caller can fall back to another capture method.
+    """
+    sink = pipeline.get_by_name("sink")
+    bus = pipeline.get_bus()
+    timeout = int(GST_PULL_TIMEOUT * Gst.SECOND)
+    failures = 0
+    try:
+        while True:
+            sample = sink.emit("try-pull-sample", timeout)
+            if sample is None:
+                # A failed pipeline just stops delivering, so ask the bus why
+                message = bus.pop_filtered(Gst.MessageType.ERROR | Gst.MessageType.EOS)
+                if message is not None:
+                    if message.type == Gst.MessageType.ERROR:
+                        error, _ = message.parse_error()
+                        print(f"GStreamer pipeline failed: {error.message}")
+                    else:
+                        print("GStreamer pipeline reached end of stream")
+                    return
+
+                # Report the start of a failure streak rather than every retry
+                if failures == 0:
+                    print("Failed to pull frame from GStreamer pipeline")
+                failures += 1
+                continue
+            failures = 0
+
+            buffer = sample.get_buffer()
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if not success:
+                continue
+            try:
+                # publish_jpeg copies the frame, so hand it the mapped buffer directly
+                publish_jpeg(map_info.data)
+            finally:
+                buffer.unmap(map_info)
+    finally:
+        # Release the camera for the fallbacks
+        pipeline.set_state(Gst.State.NULL)
+
+def open_ffmpeg_process():
+    """
+    Spawn ffmpeg to capture and encode the camera stream.
+    Returns the Popen object, or None if ffmpeg is not installed.
+    """
+    if shutil.which(FFMPEG_COMMAND[0]) is None:
+        return None
+
+    print(f"Using ffmpeg: {' '.join(FFMPEG_COMMAND)}")
+    return subprocess.Popen(FFMPEG_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+def capture_ffmpeg_frames(process):
+    """
+    Split ffmpeg's JPEG stream into frames and update the global output_jpeg
+    variable
+    """
+    pending = bytearray()
+    while True:
+        chunk = process.stdout.read1(65536)
+        if not chunk:
+            print(f"ffmpeg exited with code {process.wait()}")
+            return
+
+        pending += chunk
+        while True:
+            end = pending.find(b'\xff\xd9')  # JPEG end
+            if end == -1:
+                break
+            start = pending.find(b'\xff\xd8')  # JPEG start
+            if 0 <= start < end:
+                # Publish straight from a view; publish_jpeg makes the only copy
+                with memoryview(pending) as view:
+                    publish_jpeg(view[start:end + 2])
+            del pending[:end + 2]
+
 def capture_frames():
     """
-    Capture frames from the camera and update the global output_frame variable
+    Capture frames from the camera and update the global output_jpeg variable
     """
-    global output_frame, camera, lock
+    global camera, frame_shm
     
+    frame_shm = open_frame_shm()
+    
+    # Best case: the camera itself delivers JPEG, so nothing gets encoded
+    capture_v4l2_frames()
+
+    # A Pi camera module doesn't deliver JPEG, but the SoC can encode it
+    capture_picamera2_frames()
+
+    # Otherwise prefer a pipeline that encodes JPEG for us (hardware when available).
+    # If the pipeline fails we fall back to ffmpeg or OpenCV below.
+    pipeline = open_jpeg_pipeline()
+    if pipeline is not None:
+        capture_jpeg_frames(pipeline)
+
+    # Next best is letting ffmpeg do the capture and encoding natively.
+    # If ffmpeg exits we fall back to capturing with OpenCV below.
+    process = open_ffmpeg_process()
+    if process is not None:
+        capture_ffmpeg_frames(process)
+
     # Initialize camera
     if camera is None:
         # Try to open the camera
-        camera = cv2.VideoCapture(0)  # Use 0 for the default camera
+        camera = cv2.VideoCapture(0, cv2.CAP_V4L2)  # Use 0 for the default camera
+        
+        # Request MJPEG before the resolution so the driver picks a matching mode
+        camera.set(cv2.CAP_PROP_FOURCC, MJPG_FOURCC)
         
         # Set resolution
         camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        camera.set(cv2.CAP_PROP_FPS, 30)
+        
+        # Keep only the newest frame queued so the stream doesn't lag behind
+        camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         
         # Allow camera to warm up
         time.sleep(2.0)
     
-    # Keep capturing frames
+    # If the camera really delivers MJPEG, ask OpenCV for the undecoded data
+    # and forward it as-is instead of decoding and re-encoding every frame
+    passthrough = (int(camera.get(cv2.CAP_PROP_FOURCC)) == MJPG_FOURCC
+                   and camera.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+    
+    # Keep capturing frames. Each frame is encoded (or copied) before the next
+    # read, so OpenCV can decode into the same array every time.
+    failures = 0
+    frame = None
     while True:
-        success, frame = camera.read()
+        success, frame = camera.read(frame)
         
         if not success:
-            print("Failed to capture frame from camera")
+            # Report the start of a failure streak rather than every retry
+            if failures == 0:
+                print("Failed to capture frame from camera")
+            failures += 1
             time.sleep(0.1)
             continue
+        failures = 0
+        
+        # Undecoded MJPEG comes back as a single row of JPEG bytes
+        if passthrough and frame.shape[0] == 1:
+            frame_bytes = frame.tobytes()
+            # Skip damaged frames; clients keep the last good one
+            if is_complete_jpeg(frame_bytes):
+                publish_jpeg(frame_bytes)
+            continue
         
-        # Acquire lock before updating the output frame
-        with lock:
-            output_frame = frame.copy()
+        # Encode once here rather than once per connected client
+        frame_bytes = encode_frame(frame)
+        if frame_bytes is not None:
+            publish_jpeg(frame_bytes)
 
 def generate_frames():
     """
-    Generate MJPEG stream from output_frame
+    Generate MJPEG stream from output_part
     """
-    global output_frame, lock
+    last_seq = 0
     
     while True:
-        # Wait until we have a frame
-        with lock:
-            if output_frame is None:
+        # Block until the capture thread publishes a frame we haven't sent
+        with frame_ready:
+            frame_ready.wait_for(lambda: frame_seq != last_seq, timeout=1.0)
+            if frame_seq == last_seq:
                 continue
-            
-            # Encode the frame as JPEG
-            ret, encoded_frame = cv2.imencode('.jpg', output_frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-            
-            if not ret:
-                continue
-            
-            # Convert to bytes
-            frame_bytes = encoded_frame.tobytes()
-        
-        # Yield the frame in MJPEG format
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            last_seq = frame_seq
+            part = output_part
         
-        # Add a short delay
-        time.sleep(0.04)  # ~25 FPS
+        yield part
 
 @app.route('/')
 def index():
@@ -123,15 +507,17 @@ def index():
     Serve the main HTML page
     """
     # Use the template instead of rendering from a file
-    return render_template_string(HTML_TEMPLATE)
+    return INDEX_HTML
 
 @app.route('/video_feed')
 def video_feed():
     """
     Route to serve the video feed
     """
+    # The generator already yields bytes, so let them go straight to the server
     return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+                    mimetype='multipart/x-mixed-replace; boundary=frame',
+                    direct_passthrough=True)
 
 def render_template_string(template_string):
     """
@@ -140,6 +526,41 @@ def render_template_string(template_string):
     # Replace the url_for function call with the actual URL
     return template_string.replace("{{ url_for('video_feed') }}", "/video_feed")
 
+# The page is static, so render it once instead of on every request
+INDEX_HTML = render_template_string(HTML_TEMPLATE)
+
+async def async_index(request):
+    """
+    Serve the main HTML page (aiohttp)
+    """
+    return web.Response(text=INDEX_HTML, content_type='text/html')
+
+async def async_video_feed(request):
+    """
+    Serve the video feed (aiohttp). Each viewer is a coroutine waiting for
+    the next frame rather than a thread.
+    """
+    response = web.StreamResponse(
+        headers={'Content-Type': 'multipart/x-mixed-replace; boundary=frame'})
+    await response.prepare(request)
+
+    try:
+        while True:
+            await frame_event.wait()
+            await response.write(output_part)
+    except ConnectionResetError:
+        pass  # Viewer went away
+    return response
+
+async def start_async_clients(async_app):
+    """
+    Let the capture thread reach the aiohttp event loop
+    """
+    global async_loop, frame_event
+
+    frame_event = asyncio.Event()
+    async_loop = asyncio.get_running_loop()
+
 def main():
     """
     Main function to start the server
@@ -154,9 +575,17 @@ def main():
     frame_thread = threading.Thread(target=capture_frames, daemon=True)
     frame_thread.start()
     
-    # Start the Flask server
     print(f"Starting video streaming server on http://{args.host}:{args.port}/")
-    app.run(host=args.host, port=args.port, threaded=True, debug=False)
+    if web is not None:
+        # Serve viewers as coroutines on one event loop
+        async_app = web.Application()
+        async_app.router.add_get('/', async_index)
+        async_app.router.add_get('/video_feed', async_video_feed)
+        async_app.on_startup.append(start_async_clients)
+        web.run_app(async_app, host=args.host, port=args.port, print=None)
+    else:
+        # Start the Flask server
+        app.run(host=args.host, port=args.port, threaded=True, debug=False)
 
 if __name__ == "__main__":
     # First, make sure opencv and flask are installed
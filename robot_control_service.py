@@ -1,11 +1,42 @@
 #!/usr/bin/python3
 
+import asyncio
+import functools
+import logging
 import socket
-import time
+import struct
 import os
 import sys
 import json
+import queue
+import selectors
 import threading
+from collections import deque
+
+# orjson parses and serializes in C and is much faster than json when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Per-command tracing is at DEBUG level, so normal runs skip formatting it.
+# Set ROBOT_CONTROL_LOG_LEVEL=DEBUG to see every command received.
+LOG_LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL,
+}
+logging.basicConfig(level=LOG_LEVELS.get(os.environ.get('ROBOT_CONTROL_LOG_LEVEL', 'INFO').upper(), logging.INFO),
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+log = logging.getLogger(__name__)
+
+# uvloop runs the event loop on libuv, which is faster than asyncio's own loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # Import the MotorEventLogger
 from motor_event_logger import MotorEventLogger
@@ -39,28 +70,63 @@ if not motor_controller.load_calibration():
         motor_controller.calibrate_motor(motor_id, motor_data["name"], motor_data["min_pos"], motor_data["max_pos"])
     motor_controller.save_calibration()
 
+# Send every motor to its midpoint in a single sync write, then wait only
+# until they get there (at most 3 seconds)
+midpoints = {}
 for motor_id in CALIBRATED_MOTORS:
     if motor_id in motor_controller.motor_limits:
-        midpoint = (motor_controller.motor_limits[motor_id]["min"] + motor_controller.motor_limits[motor_id]["max"]) // 2
-        motor_controller.write_pos_ex(motor_id, midpoint, 300, 50)
+        midpoints[motor_id] = motor_controller.midpoint(motor_id)
     else:
         print(f"Warning: Motor ID {motor_id} not found in calibration data.")
-time.sleep(3)
+if midpoints:
+    motor_controller.sync_write_pos_ex(midpoints, 300, 50)
+    motor_controller.wait_for_positions(midpoints, timeout=3)
 
 # --- TCP Socket Server ---
 HOST = 'localhost'  # Listen on localhost (only accessible from the same machine)
 PORT = 9000        # Choose a port (make sure it's not used by anything else)
+# Local clients can skip the TCP stack by connecting to this Unix socket instead
+SOCKET_PATH = '/tmp/robot_control.sock'
+LISTEN_BACKLOG = 1024  # Pending connections the kernel queues before refusing more
 DEFAULT_SPEED = 500 # Define default speed.
+RECV_BUFFER_SIZE = 65536  # Per-connection receive buffer; also the longest command accepted
+COMMAND_CACHE_SIZE = 512  # Distinct command lines whose parsed form is remembered
+# Longest a thread holds the GIL while another waits for it (Python's default is 5 ms)
+GIL_SWITCH_INTERVAL = 0.001
+# SCHED_FIFO priority of the command thread; must not exceed LimitRTPRIO in the unit file
+COMMAND_THREAD_RT_PRIORITY = 10
 
 # --- Command Queue ---
-command_queue = [] # List for commands  # Use a list as a simple queue
-current_moving_motor = None  # Keep track of the currently moving motor
+command_queue = queue.Queue()  # Commands from clients; None tells process_commands to exit
+# Keep track of the currently moving motor. Only the command thread reads or
+# writes it, so it needs no lock.
+current_moving_motor = None
+# Ack for queued commands, encoded once since it never changes
+COMMAND_RECEIVED = json.dumps({"success": True, "message": "Command received"}).encode('utf-8') + b'\n'
+INVALID_JSON = b"Error: Invalid JSON format\n"
+COMMAND_TOO_LONG = b"Error: Command too long\n"
+INVALID_BINARY_COMMAND = b"Error: Invalid binary command\n"
+# (motor_id, motor_name) for every calibrated motor, used by stop_all
+CALIBRATED_MOTOR_NAMES = tuple((motor_id, motor_controller.initial_motor_data[motor_id]['name'])
+                               for motor_id in CALIBRATED_MOTORS)
+
+# Compact alternative to a JSON line for the frequent motor commands:
+# marker, command, motor ID, direction, speed (0 for the default speed).
+# The marker byte can't start a JSON command, so both kinds can be mixed on
+# one connection.
+BINARY_COMMAND = struct.Struct('!BBBBH')
+BINARY_COMMAND_MARKER = 0
+BINARY_COMMAND_TYPES = {1: 'move', 2: 'stop', 3: 'stop_all'}
+BINARY_DIRECTIONS = {0: None, 1: 'inc', 2: 'dec', 3: 'up', 4: 'down', 5: 'left', 6: 'right'}
+MOTOR_NAMES_BY_ID = dict(CALIBRATED_MOTOR_NAMES)
 
 # Define video sources for recording
 video_sources = [
     {
-        'source': 'http://localhost:5000/video_feed', # Update with your actual stream URL
-        'method': 'stream',
+        # Frames shared in memory by python_stream_server; for another stream
+        # server use 'source': 'http://localhost:5000/video_feed', 'method': 'stream'
+        'source': 'robot_camera_jpeg',
+        'method': 'shm',
         'camera_id': 0
     }
 ]
@@ -68,203 +134,462 @@ video_sources = [
 # Initialize the motor event logger with video sources
 logger = MotorEventLogger(base_dir="robot_logs", video_sources=video_sources)
 
-def handle_client(conn, addr):
-    with conn:
-        while True:
-            try:
-                data = conn.recv(1024)  # Receive data from the client
-                print(f"[{time.time()}] Data received: {data}")
-                if not data:
-                    break  # Client disconnected
-                try:
-                    command = json.loads(data.decode('utf-8').strip()) #Expect a JSON
-                except:
-                    conn.sendall(b"Error: Invalid JSON format")
+def send_result(transport, result):
+    """Queues a JSON result to be sent to a client, as one line."""
+    if orjson is not None:
+        transport.write(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE))
+    else:
+        transport.write(json.dumps(result).encode('utf-8') + b'\n')
+
+
+def parse_command(data):
+    """Parses a JSON command received from a client as bytes or a memoryview."""
+    if orjson is not None:
+        return orjson.loads(data)  # Takes buffers and ignores surrounding whitespace
+    return json.loads(str(data, 'utf-8'))
+
+
+@functools.lru_cache(maxsize=COMMAND_CACHE_SIZE)
+def parse_command_cached(data):
+    """Parses a command line given as bytes, remembering recent results.
+
+    A held button in the UI sends the same line over and over, so most lines
+    skip the JSON parser. Every caller gets the same dict for the same line,
+    so commands must not be modified after parsing.
+    """
+    return parse_command(data)
+
+
+def handle_start_logging(command):
+    """Starts recording an episode."""
+    action_name = command.get('action_name', 'unnamed_action')
+    description = command.get('description', '')
+    timeout = command.get('timeout')
+    
+    # Check if video sources are provided in the command
+    if 'video_sources' in command:
+        logger.setup_video_sources(command['video_sources'])
+    
+    success, message = logger.start_logging(
+        action_name=action_name, 
+        description=description, 
+        timeout=timeout
+    )
+    return {"success": success, "message": message}
+
+
+def handle_stop_logging(command):
+    """Stops recording the current episode."""
+    success, message = logger.stop_logging()
+    return {"success": success, "message": message}
+
+
+# Commands answered directly by the client handler instead of going to the queue
+CONTROL_HANDLERS = {
+    'start_logging': handle_start_logging,
+    'stop_logging': handle_stop_logging,
+}
+
+
+class ControlProtocol(asyncio.BufferedProtocol):
+    """Serves one client connection. All clients share the event loop.
+
+    Each command and each response is one line of JSON, so a client can send
+    several commands without waiting. Motor commands may also be sent as
+    BINARY_COMMAND records, which are answered the same way. The event loop receives straight into a
+    buffer preallocated for the connection, and commands are sliced out of it
+    without copying the rest of what was received.
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Replies are tiny, don't let Nagle hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Notice clients that vanished without closing the connection
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.start = 0  # Start of the first command not yet handled
+        self.end = 0  # End of the data received so far
+        self.discarding = False  # Skipping the rest of an oversized command
+        self.busy = False  # A control command is running in the executor
+
+    def get_buffer(self, sizehint):
+        if self.start:
+            # Move the partial command left over to the front
+            self.buffer[:self.end - self.start] = self.buffer[self.start:self.end]
+            self.end -= self.start
+            self.start = 0
+        if self.end == len(self.buffer):
+            # No newline anywhere in a full buffer; drop the oversized command
+            if not self.discarding:
+                self.transport.write(COMMAND_TOO_LONG)
+                self.discarding = True
+            self.end = 0
+        return memoryview(self.buffer)[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        self.process_buffer()
+
+    def process_buffer(self):
+        """Handles every complete command received, in order."""
+        with memoryview(self.buffer) as view:
+            while self.start < self.end and not self.busy:
+                if not self.discarding and self.buffer[self.start] == BINARY_COMMAND_MARKER:
+                    if self.end - self.start < BINARY_COMMAND.size:
+                        break  # Rest of the command hasn't arrived yet
+                    self.handle_binary_command(*BINARY_COMMAND.unpack_from(self.buffer, self.start))
+                    self.start += BINARY_COMMAND.size
                     continue
 
-                # Handle recording commands
-                if command.get('command') == 'start_logging':
-                    action_name = command.get('action_name', 'unnamed_action')
-                    description = command.get('description', '')
-                    timeout = command.get('timeout')
-                    
-                    # Check if video sources are provided in the command
-                    if 'video_sources' in command:
-                        logger.setup_video_sources(command['video_sources'])
-                    
-                    success, message = logger.start_logging(
-                        action_name=action_name, 
-                        description=description, 
-                        timeout=timeout
-                    )
-                    result = {"success": success, "message": message}
-                    conn.sendall(json.dumps(result).encode('utf-8'))
-                    continue
-                
-                elif command.get('command') == 'stop_logging':
-                    success, message = logger.stop_logging()
-                    result = {"success": success, "message": message}
-                    conn.sendall(json.dumps(result).encode('utf-8'))
-                    continue
-                
-                # Standard commands go to the queue
-                command_queue.append(command) #Put command on the queue.
-                result = {"success":True, "message": "Command received"} #Always send a JSON repsonse
-                conn.sendall(json.dumps(result).encode('utf-8'))
+                newline = self.buffer.find(b'\n', self.start, self.end)
+                if newline == -1:
+                    break  # Rest of the command hasn't arrived yet
+                line = view[self.start:newline]
+                self.start = newline + 1
+                if self.discarding:
+                    self.discarding = False  # This was the end of the oversized command
+                elif line:  # Skip blank lines between commands
+                    self.handle_command(line)
+                del line
+                if self.transport.is_closing():
+                    break
+
+    def handle_command(self, data):
+        """Handles one received command line."""
+        data = bytes(data)
+        log.debug("Data received: %s", data)
+        try:
+            command = parse_command_cached(data) #Expect a JSON
+        except:
+            self.transport.write(INVALID_JSON)
+            return
+
+        try:
+            # Recording commands can block on the disk and on camera threads, so
+            # they run in the executor. Later commands from this client wait,
+            # so replies stay in order.
+            control_handler = CONTROL_HANDLERS.get(command.get('command'))
+            if control_handler is not None:
+                self.busy = True
+                self.transport.pause_reading()
+                loop = asyncio.get_running_loop()
+                loop.run_in_executor(None, control_handler, command).add_done_callback(self.control_done)
+                return
+
+            # Standard commands go to the queue
+            command_queue.put(command) #Put command on the queue.
+            self.transport.write(COMMAND_RECEIVED) #Always send a JSON repsonse
+
+        except Exception as e:
+            log.error("Error handling client: %s", e)
+            self.transport.write(f"Error: {e}\n".encode('utf-8')) # Send the error to the client!
+            self.transport.close()
+
+    def control_done(self, future):
+        """Sends a control command's result and carries on with this client's commands."""
+        self.busy = False
+        if self.transport.is_closing():
+            return
+        try:
+            send_result(self.transport, future.result())
+        except Exception as e:
+            log.error("Error handling client: %s", e)
+            self.transport.write(f"Error: {e}\n".encode('utf-8'))
+            self.transport.close()
+            return
+        self.transport.resume_reading()
+        self.process_buffer()
+
+    def handle_binary_command(self, marker, command_code, motor_id, direction_code, speed):
+        """Queues a motor command received as a BINARY_COMMAND record."""
+        command_type = BINARY_COMMAND_TYPES.get(command_code)
+        if command_type is None or direction_code not in BINARY_DIRECTIONS:
+            self.transport.write(INVALID_BINARY_COMMAND)
+            return
+
+        # Build the same command a JSON client would have sent
+        command = {'command': command_type, 'motor': MOTOR_NAMES_BY_ID.get(motor_id)}
+        direction = BINARY_DIRECTIONS[direction_code]
+        if direction is not None:
+            command['direction'] = direction
+        if speed:
+            command['speed'] = speed
+
+        command_queue.put(command)
+        self.transport.write(COMMAND_RECEIVED)
+
+
+def handle_move(command, motor_id, motor_name):
+    """Starts moving a motor toward the limit in the requested direction."""
+    global current_moving_motor
+
+    direction = command.get('direction')
+    speed = command.get('speed', DEFAULT_SPEED)  # Get speed, use default.
+
+    if motor_id is not None:
+        # Get current position before move; it's only needed for the log
+        current_pos = None
+        if logger.is_logging:
+            try:
+                current_pos = motor_controller.read_pos(motor_id)
+            except:
+                pass
+        
+        # Execute the move
+        result = motor_controller.move_motor(motor_id, motor_name, direction, speed)
+        
+        # Log the motor event if recording is active
+        if result['success']:
+            current_moving_motor = motor_id  # Keep tracking
+            
+            # Log the move event
+            logger.log_motor_event(
+                motor_id=motor_id,
+                motor_name=motor_name,
+                command='move',
+                direction=direction,
+                speed=speed,
+                current_pos=current_pos,
+                target_pos=result['target_position']
+            )
+    else:
+        result = {'success': False, 'message': f'Invalid move command or unknown motor: {motor_name}'}
+    return result
+
+
+def handle_stop(command, motor_id, motor_name):
+    """Stops a single motor."""
+    global current_moving_motor
+
+    if motor_id is not None:
+        # Get current position before stop; it's only needed for the log
+        current_pos = None
+        if logger.is_logging:
+            try:
+                current_pos = motor_controller.read_pos(motor_id)
+            except:
+                pass
+        
+        # Execute the stop
+        result = motor_controller.stop_motor(motor_id, motor_name)
+        
+        # Log the stop event if recording is active
+        if result['success']:
+            current_moving_motor = None  # Allow new commands
+            
+            # Log the stop event
+            logger.log_motor_event(
+                motor_id=motor_id,
+                motor_name=motor_name,
+                command='stop',
+                current_pos=current_pos
+            )
+    else:
+        result = {'success': False, 'message': f'Unknown motor to stop: {motor_name}'}
+    return result
+
+
+def handle_stop_all(command, motor_id, motor_name):
+    """Stops every calibrated motor."""
+    global current_moving_motor
+
+    # Halt everything first; logging can wait until the motors are stopped
+    result, positions = motor_controller.stop_all(CALIBRATED_MOTORS)
+    
+    for stopped_id, stopped_name in CALIBRATED_MOTOR_NAMES:
+        logger.log_motor_event(
+            motor_id=stopped_id,
+            motor_name=stopped_name,
+            command='stop_all',
+            current_pos=positions.get(stopped_id)
+        )
+    
+    current_moving_motor = None  # Reset motor tracking
+    return result
+
+
+def handle_move_batch(commands):
+    """Starts several moves at once with a single sync write."""
+    global current_moving_motor
+
+    # Only the latest move per motor matters, and a sync write can't
+    # address the same motor twice
+    latest = {}
+    for command in commands:
+        motor_name = command.get('motor')
+        motor_id = motor_controller.name_to_id.get(motor_name)
+        if motor_id is None:
+            print(f"Invalid move command or unknown motor: {motor_name}")
+            continue
+        latest[motor_id] = (motor_name, command.get('direction'), command.get('speed', DEFAULT_SPEED))
+
+    # Record where the motors start from, as handle_move does, with one sync read
+    positions = motor_controller.read_positions(list(latest)) if logger.is_logging and latest else {}
+
+    queued = []
+    for motor_id, (motor_name, direction, speed) in latest.items():
+        result = motor_controller.queue_move(motor_id, motor_name, direction, speed)
+        if result['success']:
+            queued.append((motor_id, motor_name, direction, speed, result['target_position']))
+        else:
+            print(result['message'])
+
+    if not queued or not motor_controller.flush_moves():
+        return
+
+    for motor_id, motor_name, direction, speed, target_pos in queued:
+        current_moving_motor = motor_id  # Keep tracking
+        logger.log_motor_event(
+            motor_id=motor_id,
+            motor_name=motor_name,
+            command='move',
+            direction=direction,
+            speed=speed,
+            current_pos=positions.get(motor_id),
+            target_pos=target_pos
+        )
+
+
+def handle_unknown(command, motor_id, motor_name):
+    """Rejects a command with no handler."""
+    return {'success': False, 'message': f'Unknown command: {command.get("command")}'}
+
 
-            except ConnectionResetError:
-                break
-            except Exception as e:
-                print(f"[{time.time()}] Error handling client: {e}")
-                conn.sendall(f"Error: {e}".encode('utf-8')) # Send the error to the client!
-                break
+# Handler for each queued command, so dispatch is a single dict lookup
+COMMAND_HANDLERS = {
+    'move': handle_move,
+    'stop': handle_stop,
+    'stop_all': handle_stop_all,
+}
+
+
+def next_is_move(pending):
+    """Returns True if the next pending command is a move."""
+    return bool(pending) and pending[0] is not None and pending[0].get('command') == 'move'
 
 
 def process_commands():
     """Processes commands from the queue."""
-    global current_moving_motor, command_queue  # Access the global variables
+    # Only this thread, which drives the serial bus, runs real-time; the
+    # event loop, executor and episode logger threads stay at normal priority
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(COMMAND_THREAD_RT_PRIORITY))
+    except (AttributeError, OSError) as e:
+        print(f"Command thread runs without real-time priority: {e}")
+
+    pending = deque()  # Commands taken off the queue but not processed yet
 
     while True:
-        if len(command_queue) > 0:  # Always process commands if they exist
-            command = command_queue.pop(0)  # Get the next command
-
-            motor_name = command.get('motor')
-            motor_id = None
-
-            # Find Motor ID
-            if motor_name:
-                for m_id, m_data in motor_controller.motor_limits.items():
-                    if m_data['name'] == motor_name:
-                        motor_id = m_id
-                        break
-                if motor_id is None:
-                    for m_id, m_data in motor_controller.initial_motor_data.items():
-                        if m_data['name'] == motor_name:
-                            motor_id = m_id
-                            break
-
-            if command.get('command') == 'move':  # Absolute positioning
-                direction = command.get('direction')
-                speed = command.get('speed', DEFAULT_SPEED)  # Get speed, use default.
-
-                if motor_id is not None:
-                    # Get current position before move
-                    current_pos = None
-                    try:
-                        current_pos = motor_controller.read_pos(motor_id)
-                    except:
-                        pass
-                    
-                    # Execute the move
-                    result = motor_controller.move_motor(motor_id, motor_name, direction, speed)
-                    
-                    # Log the motor event if recording is active
-                    if result['success']:
-                        current_moving_motor = motor_id  # Keep tracking
-                        
-                        # Try to get target position if possible
-                        target_pos = None
-                        if direction == 'max':
-                            target_pos = motor_controller.motor_limits.get(motor_id, {}).get('max')
-                        elif direction == 'min':
-                            target_pos = motor_controller.motor_limits.get(motor_id, {}).get('min')
-                        
-                        # Log the move event
-                        logger.log_motor_event(
-                            motor_id=motor_id,
-                            motor_name=motor_name,
-                            command='move',
-                            direction=direction,
-                            speed=speed,
-                            current_pos=current_pos,
-                            target_pos=target_pos
-                        )
-                else:
-                    result = {'success': False, 'message': f'Invalid move command or unknown motor: {motor_name}'}
-
-            elif command.get('command') == 'stop':
-                if motor_id is not None:
-                    # Get current position before stop
-                    current_pos = None
-                    try:
-                        current_pos = motor_controller.read_pos(motor_id)
-                    except:
-                        pass
-                    
-                    # Execute the stop
-                    result = motor_controller.stop_motor(motor_id, motor_name)
-                    
-                    # Log the stop event if recording is active
-                    if result['success']:
-                        current_moving_motor = None  # Allow new commands
-                        
-                        # Log the stop event
-                        logger.log_motor_event(
-                            motor_id=motor_id,
-                            motor_name=motor_name,
-                            command='stop',
-                            current_pos=current_pos
-                        )
-                else:
-                    result = {'success': False, 'message': f'Unknown motor to stop: {motor_name}'}
-
-            elif command.get('command') == 'stop_all':
-                result = {'success': True, 'message': "All motors stopped"}
-                
-                for motor_id in CALIBRATED_MOTORS:
-                    motor_name = motor_controller.initial_motor_data[motor_id]['name']
-                    
-                    # Get current position before stop
-                    current_pos = None
-                    try:
-                        current_pos = motor_controller.read_pos(motor_id)
-                    except:
-                        pass
-                    
-                    # Stop the motor
-                    motor_result = motor_controller.stop_motor(motor_id, motor_name)
-                    
-                    # Log the stop event
-                    if motor_result['success']:
-                        logger.log_motor_event(
-                            motor_id=motor_id,
-                            motor_name=motor_name,
-                            command='stop_all',
-                            current_pos=current_pos
-                        )
-                    
-                    if not motor_result['success']:
-                        result = motor_result  # Return the first error
-                        break
-                
-                current_moving_motor = None  # Reset motor tracking
-
-            else:
-                result = {'success': False, 'message': f'Unknown command: {command.get("command")}'}
+        if not pending:
+            # Sleep until a client queues something, then take everything
+            # that has arrived so consecutive moves can be batched
+            pending.append(command_queue.get())
+            try:
+                while True:
+                    pending.append(command_queue.get_nowait())
+            except queue.Empty:
+                pass
 
-        else:
-            time.sleep(0.05)  # Prevent CPU overuse
+        command = pending.popleft()
+        if command is None:
+            return  # Service is shutting down
+
+        command_type = command.get('command')
 
+        # Moves already waiting behind this one go out in one bus packet
+        if command_type == 'move' and next_is_move(pending):
+            moves = [command]
+            while next_is_move(pending):
+                moves.append(pending.popleft())
+            handle_move_batch(moves)
+            continue
 
+        motor_name = command.get('motor')
+        motor_id = motor_controller.name_to_id.get(motor_name)  # None for unknown or missing motor
+
+        handler = COMMAND_HANDLERS.get(command_type, handle_unknown) if isinstance(command_type, str) else handle_unknown
+        result = handler(command, motor_id, motor_name)
+
+
+
+
+def remove_stale_socket(path):
+    """Removes a socket file left behind by a previous run, refusing to
+    touch one another running service still accepts connections on."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except FileNotFoundError:
+        return
+    except ConnectionRefusedError:
+        os.unlink(path)  # Nobody is listening
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"Another Robot Control Service is listening on {path}")
+
+
+async def serve():
+    """Accepts clients on one event loop instead of a thread per connection."""
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(ControlProtocol, HOST, PORT, backlog=LISTEN_BACKLOG,
+                                      reuse_address=True)
+    print(f"Robot Control Service listening on {HOST}:{PORT}")
+
+    remove_stale_socket(SOCKET_PATH)
+    unix_server = await loop.create_unix_server(ControlProtocol, SOCKET_PATH, backlog=LISTEN_BACKLOG)
+    print(f"Robot Control Service listening on {SOCKET_PATH}")
+
+    try:
+        async with server, unix_server:
+            await asyncio.gather(server.serve_forever(), unix_server.serve_forever())
+    finally:
+        try:
+            os.unlink(SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+
+
+def new_event_loop():
+    """Creates the event loop for the control server: uvloop when installed,
+    otherwise an epoll-based asyncio loop on Linux."""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    if hasattr(selectors, 'EpollSelector'):
+        return asyncio.SelectorEventLoop(selectors.EpollSelector())
+    return asyncio.new_event_loop()
 
 
 def main():
-    # Start the command processing thread
+    # The command thread spends most of its time in serial I/O, which releases
+    # the GIL. When a reply arrives, it shouldn't wait up to 5 ms for the
+    # event loop to hand the GIL back.
+    sys.setswitchinterval(GIL_SWITCH_INTERVAL)
+
+    # Motor commands block on the serial bus, so they keep their own thread
     command_thread = threading.Thread(target=process_commands, daemon=True)
     command_thread.start()
 
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
     try: #Wrap in try/finally to ensure closure.
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # ADD THIS LINE
-            s.bind((HOST, PORT))
-            s.listen()
-            print(f"Robot Control Service listening on {HOST}:{PORT}")
-            while True:
-                conn, addr = s.accept()  # Accept a connection
-                # Start a new thread to handle each client connection
-                client_thread = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-                client_thread.start()
+        loop.run_until_complete(serve())
     finally:
+        # Cancel what is still running, such as serve() after Ctrl+C, so its
+        # cleanup runs before the loop closes
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+
+        # Let the command thread finish what it is doing and exit
+        command_queue.put(None)
+        command_thread.join(timeout=1.0)
+
         # Stop recording if active before exiting
         if logger.is_logging:
             logger.stop_logging()
@@ -1,6 +1,5 @@
 import socket
 import time
-import subprocess
 import json
 import os
 
@@ -10,28 +9,21 @@ RCS_PORT = 9000
 CALIBRATION_FILE = "../calibration.json"  # Path to calibration file
 
 def check_robot_control_service():
-    """Checks if robot_control_service.py is running."""
+    """Checks if robot_control_service.py is accepting connections."""
     try:
-        output = subprocess.check_output(["pgrep", "-f", "robot_control_service.py"]).decode('utf-8')
-        if output:
-            print("robot_control_service.py is running.")
-            return True
-        else:
-            print("robot_control_service.py is NOT running.")
-            return False
-    except subprocess.CalledProcessError:
+        socket.create_connection((RCS_HOST, RCS_PORT), timeout=0.2).close()
+        print("robot_control_service.py is running.")
+        return True
+    except OSError:
         print("robot_control_service.py is NOT running.")
         return False
-    except FileNotFoundError:
-        print("Error: pgrep command not found.  Is procps installed?")
-        return False
 
 
 def send_command(s, command_dict):
     """Sends a command using an open socket."""
     try:
         command_json = json.dumps(command_dict)
-        s.sendall(command_json.encode('utf-8'))  # Send command
+        s.sendall(command_json.encode('utf-8') + b'\n')  # Send command, one per line
         response = s.recv(1024)  # Receive response
         response_data = json.loads(response.decode('utf-8').strip())
         print(f"Response: {response_data}")
@@ -75,6 +67,7 @@ def main():
     # Open socket once
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.connect((RCS_HOST, RCS_PORT))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Commands are tiny, don't delay them
 
         # Test Each Motor
         for motor_id, motor_data in calibration_data.items():
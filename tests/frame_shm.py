@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Checks for the shared memory frame protocol in frame_shm.py: a reader must
+never hand back a frame the writer overwrote while it was being copied.
+Run directly, or with pytest.
+"""
+import multiprocessing
+import os
+import sys
+from multiprocessing import shared_memory
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from frame_shm import FRAME_SHM_HEADER, read_frame, slot_offset, write_frame
+
+SEGMENT_SIZE = FRAME_SHM_HEADER.size + 2 * 64 * 1024
+FRAMES_TO_READ = 500
+
+
+def make_frame(seq):
+    """Frame seq is a run of one byte value, with a length that varies per frame"""
+    return bytes([seq % 251]) * (1000 + (seq * 7919) % 60000)
+
+
+def check_frame(seq, frame):
+    assert frame == make_frame(seq), f"frame {seq} is torn"
+
+
+class WriteDuringCopy(bytearray):
+    """
+    Segment that publishes frames whenever a reader copies a slot, then
+    starts filling the slot after them without publishing it
+    """
+
+    def __init__(self, size):
+        super().__init__(size)
+        self.writes_per_copy = 0
+        self.next_seq = 1
+
+    def publish(self):
+        write_frame(self, make_frame(self.next_seq))
+        self.next_seq += 1
+
+    def __getitem__(self, key):
+        for _ in range(self.writes_per_copy):
+            self.publish()
+        start, _ = slot_offset(len(self), self.next_seq % 2)
+        frame = make_frame(self.next_seq)
+        self[start:start + len(frame) // 2] = frame[:len(frame) // 2]
+        return super().__getitem__(key)
+
+
+def test_read_latest():
+    buf = bytearray(SEGMENT_SIZE)
+    assert read_frame(buf, 0) is None
+
+    for seq in range(1, 4):
+        write_frame(buf, make_frame(seq))
+        assert read_frame(buf, seq - 1) == (seq, make_frame(seq))
+        assert read_frame(buf, seq) is None
+
+
+def test_oversized_frame_is_dropped():
+    buf = bytearray(SEGMENT_SIZE)
+    assert not write_frame(buf, bytes(SEGMENT_SIZE))
+    assert read_frame(buf, 0) is None
+
+
+def test_rejects_any_write_during_copy():
+    # After one write the writer is refilling the slot being copied
+    for writes in (1, 2, 3):
+        buf = WriteDuringCopy(SEGMENT_SIZE)
+        buf.publish()
+        buf.writes_per_copy = writes
+        assert read_frame(buf, 0) is None
+
+
+def write_frames(name, stop):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        seq = 1
+        while not stop.is_set():
+            write_frame(shm.buf, make_frame(seq))
+            seq += 1
+    finally:
+        shm.close()
+
+
+def test_concurrent_writer():
+    shm = shared_memory.SharedMemory(create=True, size=SEGMENT_SIZE)
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(target=write_frames, args=(shm.name, stop))
+    writer.start()
+    try:
+        last_seq = 0
+        frames = 0
+        while frames < FRAMES_TO_READ:
+            frame = read_frame(shm.buf, last_seq)
+            if frame is None:
+                continue
+            last_seq, jpg = frame
+            check_frame(last_seq, jpg)
+            frames += 1
+    finally:
+        stop.set()
+        writer.join()
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == "__main__":
+    for test in (test_read_latest, test_oversized_frame_is_dropped,
+                 test_rejects_any_write_during_copy, test_concurrent_writer):
+        test()
+        print(f"✅ {test.__name__}")
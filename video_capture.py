@@ -6,7 +6,55 @@ import numpy as np
 import threading
 import time
 import os
+import mmap
+from collections import deque
 from urllib.parse import urlparse
+from frame_shm import read_frame
+
+# simplejpeg calls libjpeg-turbo directly and is faster than cv2 when installed
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+class ReadOnlySharedMemory:
+    """
+    Read-only mapping of a POSIX shared memory segment owned by another
+    process. Unlike multiprocessing's SharedMemory it needs only read
+    permission, and it never unlinks the writer's segment.
+    """
+    
+    def __init__(self, name):
+        self.path = os.path.join('/dev/shm', name)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            stat = os.fstat(fd)
+            self._mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self._identity = (stat.st_dev, stat.st_ino)
+        self.buf = memoryview(self._mmap)
+        self.size = len(self._mmap)
+    
+    def is_replaced(self):
+        """True if the name now refers to a different segment, or to none"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self._identity
+    
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+
+# Seconds without a new shared memory frame before the source counts as stale
+SHM_STALE_TIMEOUT = 1.0
+
+# FourCC OpenCV uses for MJPEG capture
+MJPG_FOURCC = cv2.VideoWriter_fourcc(*'MJPG')
+
 
 class VideoCapture:
     """
@@ -20,7 +68,8 @@ class VideoCapture:
         
         Args:
             video_source (str): URL or device ID for the video source
-            capture_method (str): 'stream' for HTTP streaming, 'opencv' for direct capture
+            capture_method (str): 'stream' for HTTP streaming, 'opencv' for direct capture,
+                'shm' for frames shared by python_stream_server (video_source is the segment name)
             camera_id (int): Camera identifier (for GR00T naming convention)
             buffer_size (int): Number of frames to keep in buffer
         """
@@ -30,7 +79,8 @@ class VideoCapture:
         self.buffer_size = buffer_size
         self.is_running = False
         self.latest_frame = None
-        self.frame_buffer = []
+        self.latest_jpeg = None  # Encoded frame as received from an MJPEG stream
+        self.frame_buffer = deque(maxlen=buffer_size)
         self.lock = threading.Lock()
         self.capture_thread = None
         self.last_frame_time = 0
@@ -68,10 +118,32 @@ class VideoCapture:
     
     def get_frame(self):
         """Get the most recent frame"""
-        with self.lock:
-            if self.latest_frame is not None:
-                return self.latest_frame.copy()
-            return None
+        # The capture thread publishes each frame as a new object and never
+        # modifies it afterwards, so grabbing the reference needs no lock and
+        # the copy happens without blocking capture
+        frame = self.latest_frame
+        if frame is not None:
+            return frame.copy()
+        jpg = self.latest_jpeg
+        
+        # Stream frames are only decoded when someone asks for pixels
+        if jpg is not None:
+            if simplejpeg is not None:
+                return simplejpeg.decode_jpeg(jpg, colorspace='BGR', fastdct=True, fastupsample=True)
+            return cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return None
+    
+    def peek_frame(self):
+        """
+        Get the most recent frame without copying or decoding it: the JPEG
+        bytes when the source delivers JPEG, otherwise the image array.
+        Published frames are never modified, so the result can be saved later
+        with write_frame().
+        """
+        jpg = self.latest_jpeg
+        if jpg is not None:
+            return jpg
+        return self.latest_frame
     
     def save_frame(self, save_path):
         """
@@ -83,10 +155,33 @@ class VideoCapture:
         Returns:
             bool: True if saved successfully, False otherwise
         """
-        frame = self.get_frame()
+        return self.write_frame(save_path, self.peek_frame())
+    
+    @staticmethod
+    def write_frame(save_path, frame):
+        """
+        Save a frame returned by peek_frame() to the specified path
+        
+        Returns:
+            bool: True if saved successfully, False otherwise
+        """
+        # Frames from an MJPEG source are already JPEG, so write them out as-is
+        if isinstance(frame, bytes):
+            try:
+                with open(save_path, 'wb') as f:
+                    f.write(frame)
+                return True
+            except Exception as e:
+                print(f"Error saving frame: {e}")
+            return False
+        
         if frame is not None:
             try:
-                cv2.imwrite(save_path, frame)
+                if simplejpeg is not None:
+                    with open(save_path, 'wb') as f:
+                        f.write(simplejpeg.encode_jpeg(frame, quality=90, colorspace='BGR', fastdct=True))
+                else:
+                    cv2.imwrite(save_path, frame)
                 return True
             except Exception as e:
                 print(f"Error saving frame: {e}")
@@ -94,10 +189,9 @@ class VideoCapture:
     
     def _capture_loop(self):
         """Main capture loop that runs in a separate thread"""
-        if self.capture_method == 'stream':
-            self._stream_capture_loop()
-        elif self.capture_method == 'opencv':
-            self._opencv_capture_loop()
+        capture_loop = self.CAPTURE_LOOPS.get(self.capture_method)
+        if capture_loop is not None:
+            capture_loop(self)
     
     def _stream_capture_loop(self):
         """Capture loop for HTTP streaming"""
@@ -111,44 +205,106 @@ class VideoCapture:
                         time.sleep(1)
                         continue
                     
-                    # Read the stream content
-                    bytes_data = bytes()
-                    for chunk in r.iter_content(chunk_size=1024):
+                    # Read the stream content into a growable buffer, so each
+                    # chunk is appended in place instead of copying everything read so far
+                    bytes_data = bytearray()
+                    for chunk in r.iter_content(chunk_size=16384):
                         bytes_data += chunk
-                        a = bytes_data.find(b'\xff\xd8')  # JPEG start
-                        b = bytes_data.find(b'\xff\xd9')  # JPEG end
                         
-                        if a != -1 and b != -1:
-                            jpg = bytes_data[a:b+2]
-                            bytes_data = bytes_data[b+2:]
-                            
-                            # Decode the image
-                            frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                            if frame is not None:
-                                with self.lock:
-                                    self.latest_frame = frame
-                                    self.last_frame_time = time.time()
-                                    
-                                    # Maintain buffer size
-                                    self.frame_buffer.append(frame)
-                                    if len(self.frame_buffer) > self.buffer_size:
-                                        self.frame_buffer.pop(0)
-                            
-                            # Break from loop if not running anymore
-                            if not self.is_running:
+                        # A chunk can complete several small frames, so take
+                        # out every complete one or the buffer keeps growing
+                        jpgs = []
+                        while True:
+                            a = bytes_data.find(b'\xff\xd8')  # JPEG start
+                            b = bytes_data.find(b'\xff\xd9', a + 2) if a != -1 else -1  # JPEG end
+                            if b == -1:
                                 break
+                            with memoryview(bytes_data) as view:
+                                jpgs.append(bytes(view[a:b+2]))
+                            del bytes_data[:b+2]
+                        
+                        if jpgs:
+                            # Keep the JPEGs as-is; decoding waits until get_frame() needs it
+                            with self.lock:
+                                self.latest_jpeg = jpgs[-1]
+                                self.last_frame_time = time.time()
+                                
+                                # The deque drops the oldest frames once full
+                                self.frame_buffer.extend(jpgs)
+                        
+                        # Break from loop if not running anymore
+                        if not self.is_running:
+                            break
             
             except Exception as e:
                 print(f"Error capturing from stream: {e}")
                 time.sleep(1)  # Wait before retrying
     
+    def _shm_capture_loop(self):
+        """Capture loop for JPEG frames published in shared memory"""
+        shm = None
+        last_seq = 0
+        last_new_frame = time.monotonic()
+        try:
+            while self.is_running:
+                try:
+                    if shm is None:
+                        try:
+                            shm = ReadOnlySharedMemory(self.video_source)
+                        except (FileNotFoundError, ValueError):
+                            time.sleep(1)  # Stream server not running yet, or still sizing the segment
+                            continue
+                        except PermissionError as e:
+                            # Left behind by an older stream server that made it owner-only
+                            print(f"Cannot read shared memory frames: {e}")
+                            time.sleep(1)
+                            continue
+                        last_seq = 0
+                        last_new_frame = time.monotonic()
+                    
+                    frame = read_frame(shm.buf, last_seq)
+                    if frame is None:
+                        if time.monotonic() - last_new_frame > SHM_STALE_TIMEOUT:
+                            # Don't let episodes keep saving the last frame as if it were current
+                            with self.lock:
+                                self.latest_jpeg = None
+                            # A restarted stream server publishes to a new segment
+                            if shm.is_replaced():
+                                shm.close()
+                                shm = None
+                            last_new_frame = time.monotonic()
+                        time.sleep(0.01)  # No new frame yet, or it was overwritten
+                        continue
+                    last_seq, jpg = frame
+                    last_new_frame = time.monotonic()
+                    
+                    with self.lock:
+                        self.latest_jpeg = jpg
+                        self.last_frame_time = time.time()
+                        
+                        # The deque drops the oldest frame once full
+                        self.frame_buffer.append(jpg)
+                
+                except Exception as e:
+                    print(f"Error reading shared memory frames: {e}")
+                    if shm is not None:
+                        shm.close()
+                        shm = None
+                    time.sleep(1)  # Wait before retrying
+        
+        finally:
+            if shm is not None:
+                shm.close()
+    
     def _opencv_capture_loop(self):
         """Capture loop using OpenCV's VideoCapture"""
         try:
             # Initialize capture
             if self.cap is None:
                 if isinstance(self.video_source, int):
-                    self.cap = cv2.VideoCapture(self.video_source)
+                    self.cap = cv2.VideoCapture(self.video_source, cv2.CAP_V4L2)
+                    # Ask the camera for MJPEG so frames arrive already compressed
+                    self.cap.set(cv2.CAP_PROP_FOURCC, MJPG_FOURCC)
                 else:
                     self.cap = cv2.VideoCapture(self.video_source)
                 
@@ -156,18 +312,30 @@ class VideoCapture:
                     print(f"Could not open video source: {self.video_source}")
                     return
             
+            # If the camera really delivers MJPEG, keep the undecoded JPEG like
+            # the stream method does; it's only decoded if get_frame() is called.
+            # Only V4L2 devices hand back the JPEG itself: for URLs the FourCC is
+            # the stream's codec and the frames are decoded regardless.
+            passthrough = (isinstance(self.video_source, int)
+                           and int(self.cap.get(cv2.CAP_PROP_FOURCC)) == MJPG_FOURCC
+                           and self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+            
             # Capture frames
             while self.is_running and self.cap.isOpened():
                 ret, frame = self.cap.read()
                 if ret:
+                    # Undecoded MJPEG comes back as a single row of JPEG bytes
+                    if passthrough and frame.shape[0] == 1:
+                        frame = frame.tobytes()
                     with self.lock:
-                        self.latest_frame = frame
+                        if isinstance(frame, bytes):
+                            self.latest_jpeg = frame
+                        else:
+                            self.latest_frame = frame
                         self.last_frame_time = time.time()
                         
-                        # Maintain buffer size
+                        # The deque drops the oldest frame once full
                         self.frame_buffer.append(frame)
-                        if len(self.frame_buffer) > self.buffer_size:
-                            self.frame_buffer.pop(0)
                 else:
                     print("Failed to grab frame")
                     break
@@ -192,3 +360,10 @@ class VideoCapture:
             return 0
             
         return len(self.frame_buffer) / elapsed
+    
+    # Capture loop for each capture_method
+    CAPTURE_LOOPS = {
+        'stream': _stream_capture_loop,
+        'opencv': _opencv_capture_loop,
+        'shm': _shm_capture_loop,
+    }
@@ -32,8 +32,10 @@ app = Flask(__name__)
 
 # Global variables
 camera = None
-output_frame = None
+output_jpeg = None  # Latest frame, encoded once and shared by every client
+frame_seq = 0  # Incremented each time a new frame is published
 lock = threading.Lock()
+frame_ready = threading.Condition(lock)
 frame_count = 0
 last_frame_time = time.time()
 active_streams = 0
@@ -41,6 +43,22 @@ max_fps = 15  # Limit FPS to reduce load
 running = True
 stream_event = threading.Event()
 
+# GStreamer pipeline that encodes on the Raspberry Pi's hardware JPEG encoder
+# (V4L2 M2M). OpenCV hands back the encoded JPEG as a single row of bytes.
+GST_HW_JPEG_PIPELINE = (
+    "v4l2src device=/dev/video0 ! "
+    "video/x-raw,width=640,height=480,framerate={fps}/1 ! v4l2convert ! "
+    "video/x-raw,format=NV12 ! v4l2jpegenc extra-controls=c,compression_quality=70 ! "
+    "image/jpeg ! appsink max-buffers=1 drop=true sync=false"
+)
+
+# Ask the camera for MJPEG so frames arrive already compressed
+MJPG_FOURCC = cv2.VideoWriter_fourcc(*'MJPG')
+
+# Fixed parts of each multipart MJPEG frame
+FRAME_PREFIX = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+FRAME_SUFFIX = b'\r\n'
+
 # HTML template for the main page
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -129,6 +147,10 @@ def cleanup_resources():
             camera.release()
             camera = None
     
+    # Wake any streams waiting for a frame so they can exit
+    with frame_ready:
+        frame_ready.notify_all()
+    
     # Force garbage collection
     gc.collect()
     logger.info("Cleanup complete")
@@ -145,20 +167,38 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 def open_camera():
     """Open camera with retry logic"""
+    # Prefer hardware JPEG encoding so the CPU never touches the pixels
+    try:
+        cam = cv2.VideoCapture(GST_HW_JPEG_PIPELINE.format(fps=max_fps), cv2.CAP_GSTREAMER)
+        if cam.isOpened():
+            logger.info("Camera opened with hardware JPEG encoder")
+            return cam
+        cam.release()
+    except Exception as e:
+        logger.warning(f"Hardware JPEG pipeline unavailable: {str(e)}")
+    
     for attempt in range(5):
         try:
-            cam = cv2.VideoCapture(0)
+            cam = cv2.VideoCapture(0, cv2.CAP_V4L2)
             if not cam.isOpened():
                 logger.error(f"Failed to open camera on attempt {attempt+1}")
                 time.sleep(2)
                 continue
             
+            # Request MJPEG before the resolution so the driver picks a matching mode
+            cam.set(cv2.CAP_PROP_FOURCC, MJPG_FOURCC)
+            
             # Set resolution and parameters for better performance
             cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
             cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
             cam.set(cv2.CAP_PROP_FPS, max_fps)
             cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimize buffering
             
+            # If the camera really delivers MJPEG, take the undecoded frames
+            # and publish them without a decode/encode round trip
+            if int(cam.get(cv2.CAP_PROP_FOURCC)) == MJPG_FOURCC:
+                cam.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            
             logger.info("Camera opened successfully")
             return cam
         except Exception as e:
@@ -169,8 +209,8 @@ def open_camera():
     return None
 
 def capture_frames():
-    """Capture frames from the camera and update the global output_frame variable"""
-    global output_frame, camera, lock, frame_count, last_frame_time, running
+    """Capture and encode frames from the camera, publishing them to all streams"""
+    global output_jpeg, frame_seq, camera, lock, frame_count, last_frame_time, running
     
     logger.info("Starting frame capture thread")
     
@@ -182,6 +222,7 @@ def capture_frames():
             return
     
     # Keep capturing frames
+    frame = None
     frame_time = time.time()
     error_count = 0
     
@@ -204,7 +245,8 @@ def capture_frames():
                 continue
             
             # Capture frame
-            success, frame = camera.read()
+            # Frames are encoded before the next read, so let OpenCV reuse the array
+            success, frame = camera.read(frame)
             
             if not success:
                 error_count += 1
@@ -237,9 +279,21 @@ def capture_frames():
             # Resize if needed to reduce bandwidth
             # frame = cv2.resize(frame, (320, 240))
             
-            # Acquire lock before updating the output frame
-            with lock:
-                output_frame = frame.copy()
+            if frame.shape[0] == 1:
+                # Already encoded by the camera or the hardware pipeline
+                frame_bytes = frame.tobytes()
+            else:
+                # Encode once here rather than once per connected stream
+                ret, encoded_frame = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+                if not ret:
+                    continue
+                frame_bytes = encoded_frame.tobytes()
+            
+            # Publish the frame and wake every waiting stream
+            with frame_ready:
+                output_jpeg = frame_bytes
+                frame_seq += 1
+                frame_ready.notify_all()
             
         except Exception as e:
             logger.error(f"Error in capture thread: {str(e)}")
@@ -248,35 +302,29 @@ def capture_frames():
     logger.info("Frame capture thread exiting")
 
 def generate_frames():
-    """Generate MJPEG stream from output_frame with better error handling"""
-    global output_frame, lock, active_streams
+    """Generate MJPEG stream from the shared encoded frame with better error handling"""
+    global output_jpeg, frame_seq, lock, active_streams
     
     try:
         active_streams += 1
         logger.info(f"New stream connected. Active streams: {active_streams}")
+        last_seq = 0
         
         while running:
             try:
-                # Wait until we have a frame
-                with lock:
-                    if output_frame is None:
+                # Wait until the capture thread publishes a frame we haven't sent
+                with frame_ready:
+                    frame_ready.wait_for(lambda: frame_seq != last_seq or not running, timeout=1.0)
+                    if frame_seq == last_seq or output_jpeg is None:
                         continue
-                    
-                    # Encode the frame as JPEG with reduced quality for better performance
-                    _, encoded_frame = cv2.imencode('.jpg', output_frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                    
-                # Convert to bytes
-                frame_bytes = encoded_frame.tobytes()
-                
-                # Yield the frame in MJPEG format
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n'
-                       b'Content-Length: ' + f"{len(frame_bytes)}".encode() + b'\r\n\r\n' + 
-                       frame_bytes + b'\r\n')
+                    last_seq = frame_seq
+                    frame_bytes = output_jpeg
                 
-                # Add a slightly longer delay to reduce browser CPU usage
-                # Adjust this value to trade between smoothness and CPU usage
-                time.sleep(1.0/max_fps)
+                # Yield the frame in MJPEG format. The parts go out as separate
+                # chunks so the JPEG itself is never copied into a new bytes object.
+                yield FRAME_PREFIX + b'%d\r\n\r\n' % len(frame_bytes)
+                yield frame_bytes
+                yield FRAME_SUFFIX
                 
             except Exception as e:
                 logger.error(f"Error in stream generation: {str(e)}")
@@ -292,19 +340,24 @@ def generate_frames():
 @app.route('/')
 def index():
     """Serve the main HTML page"""
-    return render_template_string(HTML_TEMPLATE)
+    return INDEX_HTML
 
 @app.route('/video_feed')
 def video_feed():
     """Route to serve the video feed"""
+    # The generator already yields bytes, so let them go straight to the server
     return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+                    mimetype='multipart/x-mixed-replace; boundary=frame',
+                    direct_passthrough=True)
 
 def render_template_string(template_string):
     """Simple function to replace Flask's render_template_string"""
     # Replace the url_for function call with the actual URL
     return template_string.replace("{{ url_for('video_feed') }}", "/video_feed")
 
+# The page is static, so render it once instead of on every request
+INDEX_HTML = render_template_string(HTML_TEMPLATE)
+
 def main():
     """Main function to start the server"""
     logger.info("Starting video streaming server")
@@ -314,6 +367,8 @@ def main():
     parser.add_argument("--port", type=int, default=5000, help="Port to run the server on")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to run the server on")
     parser.add_argument("--fps", type=int, default=15, help="Maximum FPS")
+    parser.add_argument("--threads", type=int, default=16,
+                        help="Worker threads; each open video_feed holds one")
     args = parser.parse_args()
     
     global max_fps
@@ -329,8 +384,11 @@ def main():
         # Use a production-ready WSGI server if available
         try:
             from waitress import serve
-            logger.info("Using Waitress WSGI server")
-            serve(app, host=args.host, port=args.port, threads=4)
+            # Streams only wait on the shared frame, never on the camera, so a
+            # thread per viewer is cheap. Too few threads and new viewers (or
+            # the index page) queue behind the open streams.
+            logger.info(f"Using Waitress WSGI server with {args.threads} threads")
+            serve(app, host=args.host, port=args.port, threads=args.threads)
         except ImportError:
             # Fall back to Flask's built-in server
             logger.info("Using Flask's built-in server (production use not recommended)")
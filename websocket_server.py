@@ -1,13 +1,19 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 import socket
 import asyncio
-from starlette.concurrency import run_in_threadpool
+from collections import deque
 import time
 import json
 import os
 import logging
 import sys
 
+# orjson parses and serializes in C and is much faster than json when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging based on environment variable
 def setup_logging():
     # Get log level from environment variable (default to INFO)
@@ -93,7 +99,7 @@ logger = setup_logging()
 #   "video_sources": [                // Optional
 #     {
 #       "source": "<video_source_url>",
-#       "method": "<stream_or_opencv>",
+#       "method": "<stream_opencv_or_shm>",
 #       "camera_id": <camera_id_number>
 #     }
 #   ]
@@ -119,39 +125,131 @@ app = FastAPI()
 # --- Robot Control Service Communication ---
 RCS_HOST = 'localhost'
 RCS_PORT = 9000
+RCS_SOCKET_PATH = '/tmp/robot_control.sock'  # Preferred over TCP when the RCS has created it
 WS_PORT = 8000  # WebSocket server port
+RCS_POOL_SIZE = 4  # Number of idle RCS connections kept open for reuse
+WS_MAX_MESSAGE_SIZE = 4096  # Largest WebSocket message accepted; commands are far smaller
 
 # List of valid motors and directions
 VALID_MOTORS = ["base", "shoulder", "elbow", "wrist", "hand", "thumb"]
 VALID_DIRECTIONS = ["inc", "dec"]
+# Hashed copies for the per-command membership checks; the lists above keep
+# their order for error messages
+MOTOR_NAMES = frozenset(VALID_MOTORS)
+DIRECTION_NAMES = frozenset(VALID_DIRECTIONS)
 
 
-def send_command_to_rcs(command_json: str) -> str:
-    """Sends a JSON command to the Robot Control Service and returns the response."""
-    logger.debug(f"send_command_to_rcs called with command: {command_json}")
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            logger.debug(f"Connecting to RCS at {RCS_HOST}:{RCS_PORT}")
-            s.connect((RCS_HOST, RCS_PORT))
+# Idle (reader, writer) connections to the Robot Control Service, reused across
+# commands. Only touched from the event loop, so no locking is needed.
+rcs_pool = deque()
+
+
+async def connect_to_rcs():
+    """Opens a new stream connection to the Robot Control Service."""
+    # A Unix socket avoids the TCP stack entirely for this same-machine hop
+    if os.path.exists(RCS_SOCKET_PATH):
+        try:
+            logger.debug(f"Connecting to RCS at {RCS_SOCKET_PATH}")
+            reader, writer = await asyncio.open_unix_connection(RCS_SOCKET_PATH)
             logger.debug(f"Connected to RCS")
-            logger.debug(f"Sending command to RCS: {command_json}")
-            s.sendall(command_json.encode('utf-8'))  # Send the JSON string, encoded
-            logger.debug(f"Command sent to RCS")
-            response = s.recv(1024)
-            response_str = response.decode('utf-8')
-            logger.debug(f"Received response from RCS: {response_str}")
-            
-            # Add the command type to the response for client-side tracking
+            return reader, writer
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass  # Stale socket file; fall back to TCP
+
+    logger.debug(f"Connecting to RCS at {RCS_HOST}:{RCS_PORT}")
+    reader, writer = await asyncio.open_connection(RCS_HOST, RCS_PORT)
+    sock = writer.get_extra_info('socket')
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Commands are tiny, don't delay them
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    logger.debug(f"Connected to RCS")
+    return reader, writer
+
+
+def release_rcs_connection(reader, writer):
+    """Returns a healthy connection to the pool, closing it if the pool is full."""
+    if len(rcs_pool) < RCS_POOL_SIZE:
+        rcs_pool.append((reader, writer))
+    else:
+        writer.close()
+
+
+def close_rcs_pool():
+    """Closes every idle pooled connection."""
+    while rcs_pool:
+        _, writer = rcs_pool.popleft()
+        writer.close()
+
+
+def loads_json(data):
+    """Parses JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_json(obj) -> bytes:
+    """Serializes obj to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+async def exchange_with_rcs(command_json: bytes) -> bytes:
+    """Sends a JSON command over a pooled RCS connection and returns the raw response line."""
+    # Reuse an idle connection first; if it turns out to be stale, retry once on a new one
+    for attempt in range(2):
+        if rcs_pool and not attempt:
+            reader, writer = rcs_pool.popleft()
+        else:
+            reader, writer = await connect_to_rcs()
+
+        try:
+            logger.debug("Sending command to RCS: %s", command_json)
+            # The RCS reads one command per line and answers with one line
+            writer.write(command_json + b'\n')
+            await writer.drain()
+            response = await reader.readline()
+            if not response.endswith(b'\n'):
+                raise ConnectionResetError("RCS closed the connection")
+        except (BrokenPipeError, ConnectionResetError):
+            writer.close()
+            if attempt:
+                raise
+            # The RCS has most likely restarted, which leaves every pooled
+            # connection stale, so don't keep them around either
+            logger.debug(f"Stale RCS connection, reconnecting")
+            close_rcs_pool()
+            continue
+        except BaseException:
+            # Includes cancellation: the connection may hold an unread response
+            writer.close()
+            raise
+
+        release_rcs_connection(reader, writer)
+        return response
+
+
+async def send_command_to_rcs(command_json: bytes, command_type=None) -> str:
+    """Sends a JSON command to the Robot Control Service and returns the response.
+
+    command_type is the command's "command" field, added to the response for
+    the client when the RCS leaves it out.
+    """
+    try:
+        response = await exchange_with_rcs(command_json)
+        logger.debug("Received response from RCS: %s", response)
+        
+        # Add the command type to the response for client-side tracking
+        if command_type is not None:
             try:
-                cmd_data = json.loads(command_json)
-                resp_data = json.loads(response_str)
-                if "command" in cmd_data and "command" not in resp_data:
-                    resp_data["command"] = cmd_data["command"]
-                    response_str = json.dumps(resp_data)
+                resp_data = loads_json(response)
+                if "command" not in resp_data:
+                    resp_data["command"] = command_type
+                    response = dumps_json(resp_data)
             except Exception as e:
                 logger.error(f"Error enhancing response with command: {e}")
-                
-            return response_str
+            
+        return response.decode('utf-8').rstrip('\n')
     except ConnectionRefusedError:
         logger.error(f"Error: Robot Control Service not running.")
         return '{"success": false, "message": "Error: Robot Control Service not running."}'  # Return JSON
@@ -160,6 +258,85 @@ def send_command_to_rcs(command_json: str) -> str:
         return json.dumps({"success": False, "message": f"Error: {e}"})  # Return JSON
 
 
+def validate_move(data):
+    """Validates a move command"""
+    if "motor" not in data:
+        return False, "Move command requires 'motor' field"
+    if "direction" not in data:
+        return False, "Move command requires 'direction' field"
+    if data["motor"] not in MOTOR_NAMES:
+        return False, f"Invalid motor. Must be one of: {VALID_MOTORS}"
+    if data["direction"] not in DIRECTION_NAMES:
+        return False, f"Invalid direction. Must be one of: {VALID_DIRECTIONS}"
+    if "speed" in data and not isinstance(data["speed"], (int, float)):
+        return False, "Speed value must be a number"
+    return True, None
+
+
+def validate_move_to(data):
+    """Validates a move_to command"""
+    if "motor" not in data:
+        return False, "Move_to command requires 'motor' field"
+    if "position" not in data:
+        return False, "Move_to command requires 'position' field"
+    if data["motor"] not in MOTOR_NAMES:
+        return False, f"Invalid motor. Must be one of: {VALID_MOTORS}"
+    if not isinstance(data["position"], (int, float)):
+        return False, "Position value must be a number"
+    if "speed" in data and not isinstance(data["speed"], (int, float)):
+        return False, "Speed value must be a number"
+    return True, None
+
+
+def validate_stop(data):
+    """Validates a stop command"""
+    if "motor" not in data:
+        return False, "Stop command requires 'motor' field"
+    if data["motor"] not in MOTOR_NAMES:
+        return False, f"Invalid motor. Must be one of: {VALID_MOTORS}"
+    return True, None
+
+
+def validate_start_logging(data):
+    """Validates a start_logging command"""
+    if "action_name" not in data:
+        return False, "start_logging command requires 'action_name' field"
+    
+    # Optional timeout validation
+    if "timeout" in data and not isinstance(data["timeout"], (int, float)):
+        return False, "Timeout value must be a number"
+        
+    # Optional video_sources validation
+    if "video_sources" in data:
+        if not isinstance(data["video_sources"], list):
+            return False, "video_sources must be an array"
+            
+        for source in data["video_sources"]:
+            if not isinstance(source, dict):
+                return False, "Each video source must be an object"
+            if "source" not in source:
+                return False, "Each video source requires a 'source' field"
+            if "method" in source and source["method"] not in ["stream", "opencv", "shm"]:
+                return False, "Video source method must be 'stream', 'opencv' or 'shm'"
+    return True, None
+
+
+def validate_no_arguments(data):
+    """Validates a command that takes no additional parameters"""
+    return True, None
+
+
+# Validator for each known command type, looked up once per message
+COMMAND_VALIDATORS = {
+    "move": validate_move,
+    "move_to": validate_move_to,
+    "stop": validate_stop,
+    "stop_all": validate_no_arguments,
+    "start_logging": validate_start_logging,
+    "stop_logging": validate_no_arguments,
+}
+
+
 def validate_command(data):
     """Validates command structure and returns (is_valid, error_message)"""
     if not isinstance(data, dict):
@@ -169,76 +346,35 @@ def validate_command(data):
         return False, "Missing 'command' field"
     
     command_type = data.get("command")
-    
-    # Validate move command
-    if command_type == "move":
-        if "motor" not in data:
-            return False, "Move command requires 'motor' field"
-        if "direction" not in data:
-            return False, "Move command requires 'direction' field"
-        if data["motor"] not in VALID_MOTORS:
-            return False, f"Invalid motor. Must be one of: {VALID_MOTORS}"
-        if data["direction"] not in VALID_DIRECTIONS:
-            return False, f"Invalid direction. Must be one of: {VALID_DIRECTIONS}"
-        if "speed" in data and not isinstance(data["speed"], (int, float)):
-            return False, "Speed value must be a number"
-    
-    # Validate move_to command
-    elif command_type == "move_to":
-        if "motor" not in data:
-            return False, "Move_to command requires 'motor' field"
-        if "position" not in data:
-            return False, "Move_to command requires 'position' field"
-        if data["motor"] not in VALID_MOTORS:
-            return False, f"Invalid motor. Must be one of: {VALID_MOTORS}"
-        if not isinstance(data["position"], (int, float)):
-            return False, "Position value must be a number"
-        if "speed" in data and not isinstance(data["speed"], (int, float)):
-            return False, "Speed value must be a number"
-    
-    # Validate stop command
-    elif command_type == "stop":
-        if "motor" not in data:
-            return False, "Stop command requires 'motor' field"
-        if data["motor"] not in VALID_MOTORS:
-            return False, f"Invalid motor. Must be one of: {VALID_MOTORS}"
-    
-    # Validate stop_all command
-    elif command_type == "stop_all":
-        # No additional validation needed for stop_all
-        pass
-    
-    # Validate start_logging command
-    elif command_type == "start_logging":
-        if "action_name" not in data:
-            return False, "start_logging command requires 'action_name' field"
-        
-        # Optional timeout validation
-        if "timeout" in data and not isinstance(data["timeout"], (int, float)):
-            return False, "Timeout value must be a number"
-            
-        # Optional video_sources validation
-        if "video_sources" in data:
-            if not isinstance(data["video_sources"], list):
-                return False, "video_sources must be an array"
-                
-            for source in data["video_sources"]:
-                if not isinstance(source, dict):
-                    return False, "Each video source must be an object"
-                if "source" not in source:
-                    return False, "Each video source requires a 'source' field"
-                if "method" in source and source["method"] not in ["stream", "opencv"]:
-                    return False, "Video source method must be 'stream' or 'opencv'"
-    
-    # Validate stop_logging command
-    elif command_type == "stop_logging":
-        # No additional validation needed for stop_logging
-        pass
-    
-    else:
+    validator = COMMAND_VALIDATORS.get(command_type) if isinstance(command_type, str) else None
+    if validator is None:
         return False, f"Unknown command: {command_type}"
     
-    return True, None
+    return validator(data)
+
+
+@app.on_event("startup")
+async def prewarm_rcs_connections():
+    """Opens the RCS connection pool ahead of the first command."""
+    for _ in range(RCS_POOL_SIZE):
+        try:
+            rcs_pool.append(await connect_to_rcs())
+        except OSError as e:
+            logger.warning(f"Could not pre-connect to RCS: {e}")
+            break
+
+
+@app.on_event("shutdown")
+async def close_rcs_connections():
+    """Closes all pooled RCS connections."""
+    close_rcs_pool()
+
+
+async def send_responses(websocket: WebSocket, outbox: asyncio.Queue):
+    """Sends queued responses to the client in order, decoupled from command handling."""
+    while True:
+        response = await outbox.get()
+        await websocket.send_text(response)
 
 
 @app.websocket("/ws")
@@ -246,25 +382,45 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logger.info(f"Client connected to WebSocket server on port {WS_PORT}")
     
+    # Responses go through an outbox so reading the next command never waits
+    # on a slow client draining the previous response
+    outbox = asyncio.Queue()
+    sender = asyncio.create_task(send_responses(websocket, outbox))
+    
     try:
         while True:
+            if sender.done():
+                # The client can no longer receive responses
+                logger.error(f"Error sending response: {sender.exception()}")
+                break
             try:
-                # Set a timeout for receiving messages
+                # Set a timeout for receiving messages. Any other receive error
+                # (disconnect, or a RuntimeError once the socket is closed)
+                # goes to the outer handlers and ends the loop.
                 data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                logger.debug(f"Raw received command: {data}")
+            except asyncio.TimeoutError:
+                # Send a ping to keep the connection alive
+                outbox.put_nowait(json.dumps({
+                    "type": "ping",
+                    "timestamp": time.time()
+                }))
+                logger.debug(f"Queued ping to keep connection alive")
+                continue
+
+            try:
+                logger.debug("Received command: %s", data)
 
                 # Try to parse the JSON
                 try:
-                    parsed_data = json.loads(data)
-                    logger.debug(f"Parsed command: {parsed_data}")
-                except json.JSONDecodeError as json_err:
+                    parsed_data = loads_json(data)
+                except json.JSONDecodeError as json_err:  # Also raised by orjson
                     error_response = json.dumps({
                         "success": False, 
                         "message": f"Invalid JSON: {str(json_err)}",
                         "received_data": data
                     })
                     logger.warning(f"JSON Decode Error: {error_response}")
-                    await websocket.send_text(error_response)
+                    outbox.put_nowait(error_response)
                     continue
 
                 # Validate command structure
@@ -276,39 +432,24 @@ async def websocket_endpoint(websocket: WebSocket):
                         "received_data": parsed_data
                     })
                     logger.warning(f"Invalid command: {error_response}")
-                    await websocket.send_text(error_response)
+                    outbox.put_nowait(error_response)
                     continue
 
-                # Convert command to JSON string for RCS
-                data_for_rcs = json.dumps(parsed_data)
+                # Convert command to JSON for RCS
+                data_for_rcs = dumps_json(parsed_data)
 
-                # Run send_command_to_rcs in a thread pool
-                response = await run_in_threadpool(send_command_to_rcs, data_for_rcs)
-                logger.debug(f"Sending response to client: {response}")
-                await websocket.send_text(response)  # Send the raw JSON string back
+                # The RCS exchange is non-blocking, so other clients keep being served
+                response = await send_command_to_rcs(data_for_rcs, parsed_data.get("command"))
+                logger.debug("Sending response to client: %s", response)
+                outbox.put_nowait(response)  # Send the raw JSON string back
 
-            except asyncio.TimeoutError:
-                # Send a ping to keep the connection alive
-                try:
-                    await websocket.send_text(json.dumps({
-                        "type": "ping",
-                        "timestamp": time.time()
-                    }))
-                    logger.debug(f"Sent ping to keep connection alive")
-                except Exception as ping_err:
-                    logger.error(f"Error sending ping: {ping_err}")
-                    break
             except Exception as inner_err:
                 error_response = json.dumps({
                     "success": False, 
                     "message": f"Unexpected error processing command: {str(inner_err)}"
                 })
                 logger.error(f"Inner loop error: {error_response}")
-                try:
-                    await websocket.send_text(error_response)
-                except Exception:
-                    # If sending the error fails, break the loop
-                    break
+                outbox.put_nowait(error_response)
 
     except WebSocketDisconnect:
         logger.info(f"Client disconnected from WebSocket server")
@@ -316,6 +457,7 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket error: {e}")
     finally:
         # Ensure cleanup happens
+        sender.cancel()
         try:
             await websocket.close()
         except Exception:
@@ -327,4 +469,9 @@ if __name__ == "__main__":
     logger.info(f"Starting WebSocket server on port {WS_PORT}...")
     logger.info(f"Valid motors: {VALID_MOTORS}")
     logger.info(f"Valid directions: {VALID_DIRECTIONS}")
-    uvicorn.run(app, host="0.0.0.0", port=WS_PORT, reload=True)  # Added reload for convenience
+    # uvloop and httptools replace the pure-Python event loop and HTTP parser.
+    # Commands are tiny JSON messages, so skip per-message deflate and cap
+    # the frame size well below the 1 MiB default.
+    uvicorn.run(app, host="0.0.0.0", port=WS_PORT, loop="uvloop", http="httptools",
+                ws_per_message_deflate=False, ws_max_size=WS_MAX_MESSAGE_SIZE,
+                reload=True)  # Added reload for convenience